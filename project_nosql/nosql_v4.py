@@ -1,50 +1,475 @@
+import copy
 import json
 import csv
 import os
+import re
+from collections import namedtuple
+
+from storage_core.catalog import Catalog
+from storage_core.chunk_cache import SHARED_CHUNK_CACHE
+from storage_core.hash_aggregate import parse_aggregates
+from storage_core.indexes import HashIndex, SortedIndex, index_key
+from storage_core.operators import scan_rows, filter_rows, project_rows, grace_hash_join, aggregate_rows, order_rows, limit_rows
+from storage_core.predicates import compile_value_test
+
+INSERT_LOG_FILE = "insert_log.jsonl"
+# keys_<n>.json holds the primary key of every document of chunk_<n>.json, in chunk order
+KEY_FILE_PREFIX = "keys_"
+
+
+RANGE_OPERATORS = ("<", "<=", ">", ">=", "between")
+
+# A condition other than equality: conditions map a field to a value (equality) or to a Comparison.
+# operator is one of ==, !=, <, <=, >, >=, in (value is a list), between (value is a (low, high) pair) and
+# and (value is a tuple of conditions on the same field, which all have to hold)
+Comparison = namedtuple("Comparison", ["operator", "value"])
+
+
+def _condition_parts(condition):
+    # The conditions a field has to satisfy: several when a where clause names the field more than once
+    if isinstance(condition, Comparison) and condition.operator == "and":
+        return condition.value
+    return (condition,)
+
+
+def _indexable_key(key):
+    return isinstance(key, (str, int, float, bool)) and key != ''
+
+
+def _walk_path(value, parts):
+    if not parts:
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+        return
+    if isinstance(value, dict):
+        if parts[0] in value:
+            yield from _walk_path(value[parts[0]], parts[1:])
+    elif isinstance(value, list):
+        if parts[0].isdigit():
+            if int(parts[0]) < len(value):
+                yield from _walk_path(value[int(parts[0])], parts[1:])
+        else:
+            for element in value:
+                yield from _walk_path(element, parts)
+
+
+def path_values(document, path):
+    """
+    Every value a dotted path reaches in a document, for filters and multikey indexes. Arrays on the way
+    and at the end are expanded: "cast.name" gives the name of every cast member, "genres" every genre,
+    "crew.0.job" the job of the first crew member. Empty when the path leads nowhere.
+    """
+    if path in document:
+        return list(_walk_path(document[path], []))
+    return list(_walk_path(document, path.split('.')))
+
+
+def get_path(document, path):
+    """
+    The value at a dotted path, for projections: "crew.0" is the first crew member and "cast.name" the list
+    of the cast members' names. None when the path leads nowhere.
+    """
+    if isinstance(document, dict) and path in document:
+        return document[path]
+    part, _, rest = path.partition('.')
+    if isinstance(document, dict):
+        value = document.get(part)
+    elif isinstance(document, list) and part.isdigit():
+        value = document[int(part)] if int(part) < len(document) else None
+    elif isinstance(document, list):
+        return [value for value in (get_path(element, path) for element in document) if value is not None]
+    else:
+        return None
+    return get_path(value, rest) if rest and value is not None else value
+
+
+def project_documents(rows, projection):
+    if not any('.' in field for field in projection):
+        return project_rows(rows, projection)
+    return ({field: get_path(record, field) for field in projection} for record in rows)
+
+
+class MultikeyHashIndex(HashIndex):
+    """Hash index of a dotted path; a document is indexed under every value the path reaches."""
+
+    def record_values(self, record):
+        return path_values(record, self.column)
+
+
+class MultikeySortedIndex(SortedIndex):
+    """Sorted index of a dotted path; a document is indexed under every value the path reaches."""
+
+    def record_values(self, record):
+        return path_values(record, self.column)
+
+
+INDEX_TYPES = {"hash": MultikeyHashIndex, "sorted": MultikeySortedIndex}
+
+_MISSING = object()
+
+
+def _literal_forms(literal):
+    # A quoted literal also matches the value without its quotes: the CLI keeps the quotes of the values it
+    # inserts, JSON documents do not have them
+    if isinstance(literal, str) and len(literal) >= 2 and literal[0] == literal[-1] and literal[0] in "'\"":
+        return [literal, literal[1:-1]]
+    return [literal]
+
+
+def _key_form(key):
+    # The primary key index holds keys the way equality matches them: without the quotes the CLI keeps and
+    # JSON numbers under their text, so '5', 5 and the number 5 are the same key
+    if isinstance(key, (int, float)) and not isinstance(key, bool):
+        return index_key(key)
+    return _literal_forms(key)[-1]
+
+
+def _key_lookups(key):
+    # The key index entries an equality condition on the primary key can find: text also finds the JSON
+    # number it spells ("5.0" the number 5)
+    form = _key_form(key)
+    return {form, index_key(form)} if isinstance(form, str) else {form}
+
+
+def _equality_test(expected):
+    forms = _literal_forms(expected)
+    keys = {index_key(form) for form in forms}
+
+    def test(value):
+        if any(value == form for form in forms):
+            return True
+        # numbers stored as JSON numbers match their text
+        return isinstance(value, (int, float)) and index_key(value) in keys
+    return test
+
+
+def _comparison_test(condition):
+    if condition.operator == "in":
+        keys = {index_key(form) for literal in condition.value for form in _literal_forms(literal)}
+        return lambda value: value is not None and index_key(value) in keys
+    if condition.operator == "between":
+        low, high = condition.value
+        tests = [compile_value_test(None, "between", bounds) for bounds in
+                 {(low, high), (_literal_forms(low)[-1], _literal_forms(high)[-1])}]
+    else:
+        tests = [compile_value_test(None, condition.operator, form) for form in _literal_forms(condition.value)]
+    # a value differs from the literal only if it differs from all of its forms
+    if condition.operator == "!=":
+        return lambda value: all(test(value) for test in tests)
+    return lambda value: any(test(value) for test in tests)
+
+
+def compile_conditions(conditions):
+    """
+    Compile {field: value or Comparison} once into a test of a document. Fields may be dotted paths into
+    nested documents. A condition holds when one of the values the path reaches satisfies it (for != when
+    all of them do), so array elements match individually. Plain values match by equality; comparisons
+    are typed like the relational engine's: numeric text compares as numbers, text as text, and a
+    missing field never matches.
+    """
+    tests = []
+    for field, field_condition in (conditions or {}).items():
+        for condition in _condition_parts(field_condition):
+            if not isinstance(condition, Comparison):
+                tests.append((field, _equality_test(condition), any))
+            else:
+                tests.append((field, _comparison_test(condition), all if condition.operator == "!=" else any))
+
+    def matches(record):
+        for field, test, combine in tests:
+            value = record.get(field, _MISSING)
+            values = path_values(record, field) if value is _MISSING or isinstance(value, list) else (value,)
+            if not combine(test(value) for value in values or (None,)):
+                return False
+        return True
+    return matches
+
+
+_CONDITION_PATTERN = re.compile(
+    r"""\s*(?:and\s+)?([\w.]+)\s*(?:
+        \s(in)\s*\(([^)]*)\)
+      | \s(between)\s+('[^']*'|"[^"]*"|[^\s;]+)\s+and\s+('[^']*'|"[^"]*"|[^\s;]+)
+      | (==|!=|<=|>=|=|<|>)\s*('[^']*'|"[^"]*"|[^\s;]+)
+    )\s*;?""", re.IGNORECASE | re.VERBOSE)
+
+
+def parse_document(text):
+    """
+    Parse "movie_id=1; cast=[{"name": "Glenn Close"}]" into a document. Values starting with [ or { are
+    JSON arrays and objects; the others are kept as text. Returns None when a field has no value.
+    """
+    parts, depth, quote, start = [], 0, None, 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char == '"':
+            quote = char
+        elif char in '[{':
+            depth += 1
+        elif char in ']}':
+            depth -= 1
+        elif char == ';' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+
+    document = {}
+    for part in parts:
+        if not part.strip():
+            continue
+        if '=' not in part:
+            return None
+        field, value = (piece.strip() for piece in part.split('=', 1))
+        if value[:1] in ('[', '{'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return None
+        document[field] = value
+    return document
+
+
+def parse_conditions(text):
+    """
+    Parse a where clause such as "year > '2000' and director='Christopher Nolan'" into conditions.
+    Conditions are separated by spaces or 'and'; values keep their quotes, like the stored values do.
+    Several conditions on one field are kept together in an "and" Comparison, so "year >= 2000 and
+    year < 2001" keeps both bounds. Returns None when the text is not a list of conditions.
+    """
+    conditions = {}
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _CONDITION_PATTERN.match(text, position)
+        if not match or match.end() == position:
+            return None
+        field = match.group(1)
+        if match.group(2):
+            condition = Comparison("in", [value.strip() for value in match.group(3).split(',') if value.strip()])
+        elif match.group(4):
+            condition = Comparison("between", (match.group(5), match.group(6)))
+        elif match.group(7) in ('=', '=='):
+            condition = match.group(8)
+        else:
+            condition = Comparison(match.group(7), match.group(8))
+        if field in conditions:
+            condition = Comparison("and", _condition_parts(conditions[field]) + (condition,))
+        conditions[field] = condition
+        position = match.end()
+    return conditions
+
 
 class NoSQLDatabase:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, chunk_cache=SHARED_CHUNK_CACHE):
         self.data_dir = os.path.abspath(data_dir)
+        # Decoded chunks are kept in an LRU cache shared with the other engines of the process; None disables it
+        self.chunk_cache = chunk_cache
         self.max_records_per_chunk = 1000
+        self.insert_log_threshold = 1000
+        self.sort_memory_rows = 100000
+        self.aggregate_memory_groups = 100000
+        self.join_memory_rows = 100000
+        # chunks read and skipped by the last filtered select, update or delete
+        self.last_scan_stats = {"chunks_scanned": 0, "chunks_skipped": 0, "index_used": None}
         self.tables = {}
+        # Schemas, primary keys, index definitions and chunk lists of every collection in one file
+        self.catalog = Catalog.load(self.data_dir)
         self.initialize_tables()
 
     def initialize_tables(self):
         """
-        Initialize the self.tables dictionary with existing tables and their chunks.
+        Initialize the self.tables dictionary from the catalog. Collection directories the catalog does not
+        know yet (written before the catalog existed, or by create_tables_from_csv.py) are read once and added.
         """
+        catalog_changed = False
         for item in os.listdir(self.data_dir):
             path = os.path.join(self.data_dir, item)
             if os.path.isdir(path):
                 table_name = item
-                first_file = next((f for f in os.listdir(path) if f.endswith('.json')), None)
-                if first_file:
-                    first_file_path = os.path.join(path, first_file)
-                    with open(first_file_path, "r", encoding='utf-8') as file:
-                        first_record = json.load(file)[0]
-                        columns = list(first_record.keys())
-                        self.tables[table_name] = {
-                            "columns": columns,
-                            "data_dir": path
-                        }
-
-    def create_table(self, table_name: str, columns: list, overwrite_existing=False):
+                entry = self.catalog.get(table_name)
+                if entry is None:
+                    entry = self.discover_collection(path)
+                    if entry is None:
+                        print(f"Collection '{table_name}' has no documents to take its fields from.")
+                        continue
+                    self.catalog.set(table_name, entry)
+                    catalog_changed = True
+                self.open_collection(table_name, path, entry)
+
+        # Collections whose directory is gone leave the catalog
+        for table_name in list(self.catalog.entries):
+            if table_name not in self.tables:
+                self.catalog.remove(table_name)
+                catalog_changed = True
+        if catalog_changed or not self.catalog.exists:
+            self.catalog.save()
+
+    def discover_collection(self, data_dir, entry=None):
+        # Build the catalog entry of a collection directory from its chunks: the document count of every
+        # chunk and, unless a previous entry knows them, the fields of the first document
+        columns = None
+        chunks = {}
+        for file_name in self.get_chunk_files(data_dir):
+            chunk_data = self.read_chunk(os.path.join(data_dir, file_name))
+            chunks[file_name] = len(chunk_data)
+            if columns is None and chunk_data:
+                columns = list(chunk_data[0].keys())
+        if entry is not None:
+            return dict(entry, chunks=chunks)
+        if columns is None:
+            return None
+        return {"columns": columns, "primary_key": columns[0], "indexes": {}, "chunks": chunks}
+
+    def rebuild_catalog(self):
+        """
+        Rebuild the catalog from the collection directories, after chunk files were written by another tool.
+        Known collections keep their fields, primary key and index definitions; indexes are brought up to
+        date when next used.
+        """
+        entries = self.catalog.entries
+        self.catalog.entries = {}
+        self.tables = {}
+        for table_name, entry in entries.items():
+            path = os.path.join(self.data_dir, table_name)
+            if os.path.isdir(path):
+                self.catalog.set(table_name, self.discover_collection(path, entry))
+        self.initialize_tables()
+        self.catalog.save()
+        print(f"Catalog rebuilt: {len(self.tables)} collections.")
+
+    def open_collection(self, table_name: str, data_dir: str, entry: dict):
+        self.tables[table_name] = {
+            "columns": entry["columns"],
+            "data_dir": data_dir,
+            "primary_key": entry["primary_key"],
+            # chunk file -> document count, kept current by write_chunk
+            "chunks": dict(entry["chunks"]),
+            "index_definitions": dict(entry["indexes"]),
+            # the secondary indexes are loaded on first use
+            "indexes": None
+        }
+        self.reset_key_index(table_name)
+        self.track_insert_log(table_name)
+
+    def commit_table(self, table_name: str):
+        """
+        Save what the writes of a statement changed: the secondary indexes, then the collection's catalog entry.
+        """
+        table_info = self.tables[table_name]
+        if table_info["indexes"] is not None:
+            for index in table_info["indexes"].values():
+                if index.dirty:
+                    index.save()
+            table_info["index_definitions"] = {name: {"column": index.column, "type": index.kind}
+                                               for name, index in table_info["indexes"].items()}
+        self.catalog.set(table_name, {"columns": table_info["columns"], "primary_key": table_info["primary_key"],
+                                      "indexes": table_info["index_definitions"], "chunks": table_info["chunks"]})
+        self.catalog.save(table_name)
+
+    def table_indexes(self, table_name: str):
+        """
+        The secondary indexes of a collection, loaded on first use. Index entries of chunks written since
+        the index was saved are rebuilt.
+        """
+        table_info = self.tables[table_name]
+        if table_info["indexes"] is None:
+            data_dir = table_info["data_dir"]
+            chunk_files = self.chunk_files(table_name)
+            indexes = {}
+            for index_name, definition in table_info["index_definitions"].items():
+                index_path = os.path.join(data_dir, f"index_{index_name}.json")
+                index = INDEX_TYPES[definition["type"]].load(index_name, definition["column"], index_path)
+                saved_at = os.stat(index_path).st_mtime_ns if os.path.exists(index_path) else -1
+                for file_name in list(index.entries):
+                    if file_name not in table_info["chunks"]:
+                        index.drop_chunk(file_name)
+                for file_name in chunk_files:
+                    chunk_path = os.path.join(data_dir, file_name)
+                    if file_name not in index.entries or os.stat(chunk_path).st_mtime_ns > saved_at:
+                        index.index_chunk(file_name, self.read_chunk(chunk_path))
+                indexes[index_name] = index
+            table_info["indexes"] = indexes
+            for index in indexes.values():
+                if index.dirty:
+                    index.save()
+        return table_info["indexes"]
+
+    def create_index(self, index_name: str, table_name: str, field: str, index_type: str = "sorted"):
+        """
+        Build a persistent secondary index on one field: sorted (equality, ranges, in) or hash (equality, in).
+        """
+        lowercase_table_name = table_name.lower()
+        if lowercase_table_name not in self.tables:
+            print(f"Table '{table_name}' does not exist.")
+            return
+        table_info = self.tables[lowercase_table_name]
+        if index_name in self.table_indexes(lowercase_table_name):
+            print(f"Index '{index_name}' already exists on '{table_name}'.")
+            return
+        if index_type not in INDEX_TYPES:
+            print(f"Unknown index type '{index_type}'. Use one of: {', '.join(INDEX_TYPES)}.")
+            return
+
+        # Documents still in the insert log are not indexed, so they go to the chunks first
+        self.flush_insert_log(lowercase_table_name)
+        data_dir = table_info["data_dir"]
+        index = INDEX_TYPES[index_type](index_name, field, os.path.join(data_dir, f"index_{index_name}.json"))
+        for file_name in self.chunk_files(lowercase_table_name):
+            index.index_chunk(file_name, self.read_chunk(os.path.join(data_dir, file_name)))
+        table_info["indexes"][index_name] = index
+        self.commit_table(lowercase_table_name)
+        print(f"Index '{index_name}' created on {table_name}({field}) using {index_type}.")
+
+    def reset_key_index(self, table_name: str):
+        # The key index is loaded from the key files on first use
+        self.tables[table_name]["key_index"] = None
+        self.tables[table_name]["chunk_keys"] = None
+
+    def track_insert_log(self, table_name: str):
+        table_info = self.tables[table_name]
+        log_rows = self.read_insert_log(table_name)
+        table_info["log_rows"] = len(log_rows)
+        # key -> position of the documents still waiting in the insert log
+        table_info["log_keys"] = {}
+        for position, record in enumerate(log_rows):
+            key = record.get(table_info["primary_key"])
+            if _indexable_key(key):
+                table_info["log_keys"][_key_form(key)] = position
+
+    def create_table(self, table_name: str, columns: list, overwrite_existing=False, primary_key: str = None):
         if table_name.lower() in self.tables and not overwrite_existing:
             print(f"Table '{table_name}' already exists.")
             return
         
+        primary_key = primary_key or columns[0]
+        if primary_key not in columns:
+            print(f"Primary key '{primary_key}' is not a column of '{table_name}'.")
+            return
+
         data_dir_path = os.path.join(self.data_dir, f"{table_name.lower()}")
         os.makedirs(data_dir_path, exist_ok=True)
-        data_file_path = os.path.join(data_dir_path, "chunk_0.json")
-        self.tables[table_name.lower()] = {"columns": columns, "data_dir": data_dir_path}
-        current = {column:"" for column in columns}
-
-        with open(data_file_path, "w") as file:
-            json.dump([current], file)
+        # An overwritten collection starts without documents; the catalog keeps its fields, so the
+        # collection needs no chunk until the first flush of its insert log
+        for file_name in os.listdir(data_dir_path):
+            if file_name.startswith(('chunk_', KEY_FILE_PREFIX, 'index_')) or file_name == INSERT_LOG_FILE:
+                os.remove(os.path.join(data_dir_path, file_name))
+                self.forget_chunk(os.path.join(data_dir_path, file_name))
+        self.tables[table_name.lower()] = {"columns": columns, "data_dir": data_dir_path, "log_rows": 0,
+                                           "log_keys": {}, "primary_key": primary_key, "chunks": {},
+                                           "index_definitions": {}, "indexes": {}}
+        self.reset_key_index(table_name.lower())
+        self.commit_table(table_name.lower())
 
         print("Table created.")
 
-    def insert_into(self, table_name: str, data: dict):
+    def insert_into(self, table_name: str, data: dict, upsert=False):
+        """
+        Insert a document. Primary keys are unique: a document whose key is taken is refused, or with
+        upsert replaces the document holding that key.
+        """
         if table_name not in self.tables:
             print(f"Table '{table_name}' does not exist.")
             return
@@ -52,173 +477,483 @@ class NoSQLDatabase:
         table_info = self.tables[table_name]
         data_dir = table_info["data_dir"]
         columns = table_info["columns"]
-        max_records_per_chunk = self.max_records_per_chunk
 
         if not all(key in columns for key in data.keys()):
             print("Data format does not match table columns.")
             return
 
-        files = sorted([f for f in os.listdir(data_dir) if f.endswith('.json')])
-        last_file = files[-1] if files else None
+        primary_key = table_info["primary_key"]
+        key = data.get(primary_key)
+        if not _indexable_key(key):
+            print(f"Documents need a value for the primary key '{primary_key}'.")
+            return
+        if _key_form(key) in table_info["log_keys"] or _key_form(key) in self.primary_index(table_name):
+            if not upsert:
+                print(f"A document with {primary_key}={key} already exists in '{table_name}'. Use upsert to replace it.")
+                return
+            self.replace_by_key(table_name, key, data)
+            print(f"Data upserted into table '{table_name}'.")
+            return
+
+        # Append the document to the insert log instead of rewriting the last chunk
+        with open(os.path.join(data_dir, INSERT_LOG_FILE), 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps(data) + '\n')
+        table_info["log_keys"][_key_form(key)] = table_info["log_rows"]
+        table_info["log_rows"] += 1
 
-        if last_file:
-            last_file_path = os.path.join(data_dir, last_file)
-            with open(last_file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-            
-            if len(chunk_data)==1:
-                chunk_data = [dic for dic in chunk_data if dic[columns[0]]]
+        if table_info["log_rows"] >= self.insert_log_threshold:
+            self.flush_insert_log(table_name)
+
+        print(f"Data inserted into table '{table_name}'.")
+        
+
+    def get_chunk_files(self, data_dir):
+        files = [f for f in os.listdir(data_dir) if f.startswith('chunk_') and f.endswith('.json')]
+        return sorted(files, key=lambda f: int(f.split('_')[1].split('.')[0]))
 
-            if len(chunk_data) < max_records_per_chunk:
-                chunk_data.append(data)
+    def chunk_files(self, table_name: str):
+        # The chunk files of a collection in order, from the catalog rather than a directory listing
+        return sorted(self.tables[table_name]["chunks"], key=lambda f: int(f.split('_')[1].split('.')[0]))
+
+    def read_insert_log(self, table_name: str):
+        """
+        Return the documents appended to the table's insert log that are not yet in a chunk.
+        """
+        log_path = os.path.join(self.tables[table_name]["data_dir"], INSERT_LOG_FILE)
+        if not os.path.exists(log_path):
+            return []
+        records = []
+        with open(log_path, 'r', encoding='utf-8') as log_file:
+            for line in log_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # torn last line from an interrupted write
+        return records
+
+    def flush_insert_log(self, table_name: str):
+        """
+        Fold the insert log into sealed chunk files and remove it.
+        """
+        table_info = self.tables[table_name]
+        data_dir = table_info["data_dir"]
+        columns = table_info["columns"]
+        log_rows = self.read_insert_log(table_name)
+
+        if log_rows:
+            files = self.chunk_files(table_name)
+            if files and table_info["chunks"][files[-1]] >= self.max_records_per_chunk:
+                # A full last chunk is not read, the log starts the next one
+                chunk_data = []
+                chunk_number = int(files[-1].split('_')[1].split('.')[0]) + 1
+            elif files:
+                last_file = files[-1]
+                with open(os.path.join(data_dir, last_file), 'r', encoding='utf-8') as file:
+                    chunk_data = json.load(file)
+                chunk_number = int(last_file.split('_')[1].split('.')[0])
             else:
-                chunk_data = [data]
-                last_file = f"chunk_{len(files)}.json"
-                last_file_path = os.path.join(data_dir, last_file)
+                chunk_data = []
+                chunk_number = 0
+
+            # Drop the empty placeholder document older versions of create_table wrote
+            if len(chunk_data) == 1:
+                chunk_data = [dic for dic in chunk_data if dic.get(columns[0])]
+
+            for record in log_rows:
+                if len(chunk_data) >= self.max_records_per_chunk:
+                    self.write_chunk(table_name, f"chunk_{chunk_number}.json", chunk_data)
+                    chunk_data = []
+                    chunk_number += 1
+                chunk_data.append(record)
+            self.write_chunk(table_name, f"chunk_{chunk_number}.json", chunk_data)
 
-            with open(last_file_path, 'w', encoding='utf-8') as file:
-                json.dump(chunk_data, file, indent=4)
+            self.commit_table(table_name)
 
+        log_path = os.path.join(data_dir, INSERT_LOG_FILE)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        table_info["log_rows"] = 0
+        table_info["log_keys"] = {}
+
+    def write_chunk(self, table_name: str, file_name: str, chunk_data):
+        file_path = os.path.join(self.tables[table_name]["data_dir"], file_name)
+        # Write to a temporary file first so readers never see a half written chunk
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(chunk_data, file, indent=4)
+        os.replace(tmp_path, file_path)
+        self.forget_chunk(file_path)
+        self.index_chunk(table_name, file_name, chunk_data)
+        self.tables[table_name]["chunks"][file_name] = len(chunk_data)
+        for index in self.table_indexes(table_name).values():
+            index.index_chunk(file_name, chunk_data)
+        return os.path.getsize(file_path)
+
+    @staticmethod
+    def key_file_name(chunk_file):
+        return KEY_FILE_PREFIX + chunk_file[len('chunk_'):]
+
+    def write_chunk_keys(self, table_name: str, file_name: str, keys):
+        table_info = self.tables[table_name]
+        key_path = os.path.join(table_info["data_dir"], self.key_file_name(file_name))
+        tmp_path = key_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"primary_key": table_info["primary_key"], "keys": keys}, file)
+        os.replace(tmp_path, key_path)
+
+    def read_chunk_keys(self, table_name: str, file_name: str):
+        """
+        The primary keys of a chunk in document order, from its key file. A key file that is missing,
+        older than the chunk or made for another primary key is rebuilt from the chunk.
+        """
+        table_info = self.tables[table_name]
+        data_dir = table_info["data_dir"]
+        chunk_path = os.path.join(data_dir, file_name)
+        key_path = os.path.join(data_dir, self.key_file_name(file_name))
+        try:
+            if os.stat(key_path).st_mtime_ns >= os.stat(chunk_path).st_mtime_ns:
+                with open(key_path, 'r', encoding='utf-8') as file:
+                    stored = json.load(file)
+                if stored.get("primary_key") == table_info["primary_key"]:
+                    return stored["keys"]
+        except (FileNotFoundError, ValueError):
+            pass
+        keys = [record.get(table_info["primary_key"]) for record in self.read_chunk(chunk_path)]
+        self.write_chunk_keys(table_name, file_name, keys)
+        return keys
+
+    def primary_index(self, table_name: str):
+        """
+        The table's primary key -> (chunk file, position) index over the sealed chunks, loaded on first use.
+        """
+        table_info = self.tables[table_name]
+        if table_info["key_index"] is None:
+            key_index, chunk_keys = {}, {}
+            for file_name in self.chunk_files(table_name):
+                chunk_keys[file_name] = self.read_chunk_keys(table_name, file_name)
+                for position, key in enumerate(chunk_keys[file_name]):
+                    if _indexable_key(key):
+                        key_index[_key_form(key)] = (file_name, position)
+            table_info["key_index"], table_info["chunk_keys"] = key_index, chunk_keys
+        return table_info["key_index"]
+
+    def index_chunk(self, table_name: str, file_name: str, chunk_data):
+        # Keep the chunk's key file and the loaded key index in step with the rewritten chunk
+        table_info = self.tables[table_name]
+        keys = [record.get(table_info["primary_key"]) for record in chunk_data]
+        self.write_chunk_keys(table_name, file_name, keys)
+        key_index = table_info["key_index"]
+        if key_index is None:
+            return
+        for key in table_info["chunk_keys"].get(file_name, []):
+            if _indexable_key(key) and key_index.get(_key_form(key), (None,))[0] == file_name:
+                del key_index[_key_form(key)]
+        for position, key in enumerate(keys):
+            if _indexable_key(key):
+                key_index[_key_form(key)] = (file_name, position)
+        table_info["chunk_keys"][file_name] = keys
+
+    def get_by_key(self, table_name: str, key):
+        """
+        Return the document with the given primary key, or None. Reads at most one chunk.
+        """
+        table_info = self.tables[table_name]
+        key = _key_form(key)
+        if key in table_info["log_keys"]:
+            return self.read_insert_log(table_name)[table_info["log_keys"][key]]
+        location = self.primary_index(table_name).get(key)
+        if location is None:
+            return None
+        file_name, position = location
+        return copy.deepcopy(self.read_chunk(os.path.join(table_info["data_dir"], file_name))[position])
+
+    def locate_key(self, table_name: str, key):
+        # (chunk file, position) of a key; a document still in the insert log is flushed to a chunk first
+        key = _key_form(key)
+        if key in self.tables[table_name]["log_keys"]:
+            self.flush_insert_log(table_name)
+        return self.primary_index(table_name).get(key)
+
+    def replace_by_key(self, table_name: str, key, document: dict):
+        location = self.locate_key(table_name, key)
+        file_name, position = location
+        chunk_data = list(self.read_chunk(os.path.join(self.tables[table_name]["data_dir"], file_name)))
+        chunk_data[position] = dict(document)
+        self.write_chunk(table_name, file_name, chunk_data)
+        self.commit_table(table_name)
+
+    @staticmethod
+    def load_chunk(file_path):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def read_chunk(self, file_path):
+        """
+        Read a chunk file through the chunk cache. Cached chunks are shared, so the documents must not be modified.
+        """
+        if self.chunk_cache is None:
+            return self.load_chunk(file_path)
+        return self.chunk_cache.get(file_path, self.load_chunk)
+
+    def forget_chunk(self, file_path):
+        if self.chunk_cache is not None:
+            self.chunk_cache.invalidate(file_path)
+
+    def iter_chunks(self, table_name: str):
+        """
+        Yield the documents of every chunk file in order, then the pending insert log, one list at a time.
+        """
+        data_dir = self.tables[table_name]["data_dir"]
+        for file_name in self.chunk_files(table_name):
+            yield self.read_chunk(os.path.join(data_dir, file_name))
+        log_rows = self.read_insert_log(table_name)
+        if log_rows:
+            yield log_rows
+
+    def find_index(self, table_name: str, field: str, kinds=("hash", "sorted")):
+        for index in self.table_indexes(table_name).values():
+            if index.column == field and index.kind in kinds:
+                return index
+        return None
+
+    def index_lookup(self, table_name: str, field: str, condition):
+        """
+        The index answering one condition and the {chunk file: positions} of the documents it finds, or
+        None when no index of the field answers it. Indexes compare numeric text as numbers, so they may return more documents
+        than plain equality matches; the conditions are still checked on every document read.
+        """
+        if isinstance(condition, Comparison) and condition.operator == "and":
+            # Every part has to hold, so each index answering a part narrows the documents further
+            found = [lookup for lookup in (self.index_lookup(table_name, field, part) for part in condition.value)
+                     if lookup is not None]
+            if not found:
+                return None
+            locations = found[0][1]
+            for _, other in found[1:]:
+                locations = {file_name: set(positions) & set(other[file_name])
+                             for file_name, positions in locations.items() if file_name in other}
+            return found[0][0], {file_name: positions for file_name, positions in locations.items() if positions}
+
+        operator, value = condition if isinstance(condition, Comparison) else ("==", condition)
+        if operator in ("==", "in"):
+            index = self.find_index(table_name, field)
+        elif operator in RANGE_OPERATORS:
+            index = self.find_index(table_name, field, ("sorted",))
         else:
-            first_file = "chunk_0.json"
-            first_file_path = os.path.join(data_dir, first_file)
-            with open(first_file_path, 'w', encoding='utf-8') as file:
-                json.dump([data], file, indent=4)
+            index = None
+        if index is None:
+            return None
 
-        print(f"Data inserted into table '{table_name}'.")
-        
+        # A quoted literal is looked up with and without its quotes, like compile_conditions matches it
+        if operator == "==":
+            lookups = [index.lookup(form) for form in _literal_forms(value)]
+        elif operator == "in":
+            lookups = [index.lookup(form) for literal in value for form in _literal_forms(literal)]
+        elif operator == "between":
+            lookups = [index.range_lookup(low, high) for low, high in
+                       {(value[0], value[1]), (_literal_forms(value[0])[-1], _literal_forms(value[1])[-1])}]
+        elif operator in ("<", "<="):
+            lookups = [index.range_lookup(high=form, include_high=operator == "<=") for form in _literal_forms(value)]
+        else:
+            lookups = [index.range_lookup(low=form, include_low=operator == ">=") for form in _literal_forms(value)]
+        locations = {}
+        for found in lookups:
+            for file_name, positions in found.items():
+                locations.setdefault(file_name, set()).update(positions)
+        return index, locations
+
+    def plan_chunks(self, table_name: str, conditions: dict):
+        """
+        The documents conditions have to read, as {chunk file: positions}, or None when every chunk has to
+        be scanned: the primary key index answers equality on the key, a secondary index one of the others.
+        The insert log is not indexed and is always read.
+        """
+        table_info = self.tables[table_name]
+        files = self.chunk_files(table_name)
+        self.last_scan_stats = {"chunks_scanned": len(files), "chunks_skipped": 0, "index_used": None}
+        primary_key = table_info["primary_key"]
+        keys = [part for part in _condition_parts((conditions or {}).get(primary_key))
+                if not isinstance(part, Comparison)] if primary_key in (conditions or {}) else []
+        if keys:
+            key = keys[0]
+            # Like index_lookup, every form of a quoted literal is looked up and the locations merged
+            key_index = self.primary_index(table_name)
+            locations = {}
+            for form in _key_lookups(key) if _indexable_key(key) else ():
+                if form in key_index:
+                    file_name, position = key_index[form]
+                    locations.setdefault(file_name, set()).add(position)
+            index_used = primary_key
+        else:
+            found = None
+            for field, condition in (conditions or {}).items():
+                found = self.index_lookup(table_name, field, condition)
+                if found is not None:
+                    break
+            if found is None:
+                return None
+            index_used, locations = found[0].name, found[1]
+        self.last_scan_stats = {"chunks_scanned": len(locations), "chunks_skipped": len(files) - len(locations),
+                                "index_used": index_used}
+        return locations
+
+    def iter_planned(self, table_name: str, locations):
+        # Like iter_chunks, but only the planned documents of the planned chunks
+        data_dir = self.tables[table_name]["data_dir"]
+        for file_name in self.chunk_files(table_name):
+            if file_name in locations:
+                chunk_data = self.read_chunk(os.path.join(data_dir, file_name))
+                # a multikey index can find a document under several of its values
+                yield [chunk_data[position] for position in sorted(set(locations[file_name]))]
+        log_rows = self.read_insert_log(table_name)
+        if log_rows:
+            yield log_rows
 
     def select_from(self, table_name: str, conditions: dict = None, projection: list = None,
-                    group_by: str = None, aggregate: str = None, aggregate_column: str = None, order_by: str = None):
+                    group_by: str = None, aggregate: str = None, aggregate_column: str = None, order_by: str = None,
+                    limit: int = None, offset: int = 0):
         lowercase_table_name = table_name.lower()
 
         if lowercase_table_name not in self.tables:
             print(f"Table '{table_name}' does not exist.")
             return
 
-        table_info = self.tables[lowercase_table_name]
-        data_dir = table_info["data_dir"]
-        aggregated_data = []
-
-        for file_name in sorted(os.listdir(data_dir)):
-            if file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
+        # scan -> filter -> project -> aggregate -> sort; documents flow through one at a time
+        # A condition on the primary key or on an indexed field only reads the chunks holding matches
+        locations = self.plan_chunks(lowercase_table_name, conditions)
+        if locations is None:
+            rows = scan_rows(self.iter_chunks(lowercase_table_name))
+        else:
+            rows = scan_rows(self.iter_planned(lowercase_table_name, locations))
+        if conditions:
+            rows = filter_rows(rows, compile_conditions(conditions))
+        if projection:
+            rows = project_documents(rows, projection)
 
-                    # Apply conditions and projection
-                    if conditions:
-                        chunk_data = [record for record in chunk_data if all(record.get(col) == conditions[col] for col in conditions)]
-                    if projection:
-                        chunk_data = [{col: record[col] for col in projection} for record in chunk_data]
-
-                    # Merge chunk data into aggregated data
-                    aggregated_data.extend(chunk_data)
-                
-                
-        # Apply grouping
-        if group_by:
-            grouped_data = {}
-            for record in aggregated_data:
-                group_key = record[group_by]
-                if group_key not in grouped_data:
-                    grouped_data[group_key] = []
-                grouped_data[group_key].append(record)
-
-        # Apply aggregation
-        if aggregate:
-            aggregated_result = []
-            for group, records in grouped_data.items():
-                if aggregate.lower() == 'count':
-                    aggregated_result.append({group_by: group, 'count': len(records)})
-                elif aggregate.lower() == 'sum':
-                    # Sum the specified column
-                    sum_values = sum(float(record.get(aggregate_column, 0)) for record in records)
-                    aggregated_result.append({group_by: group, 'sum': sum_values})
-                elif aggregate.lower() == 'avg':
-                    # Sum the specified column
-                    sum_values = sum(float(record.get(aggregate_column, 0)) for record in records)
-                    aggregated_result.append({group_by: group, 'avg': sum_values / len(records)})
-            aggregated_data = aggregated_result
+        # aggregate is either one function applied to aggregate_column ("sum") or a list such as
+        # "count(*),avg(vote_average)"; grouped aggregation streams into per-group accumulators
+        if group_by and aggregate:
+            if '(' in aggregate:
+                try:
+                    aggregates = parse_aggregates(aggregate)
+                except ValueError as e:
+                    print(e)
+                    return
+            else:
+                aggregates = [(aggregate.lower(), aggregate_column if aggregate.lower() != 'count' else None)]
+            # aggregates written as func(field) are named that way, so order by can refer to them
+            names = [f"{func}({column or '*'})" for func, column in aggregates] if '(' in aggregate else None
+            rows = aggregate_rows(rows, [group_by], aggregates, max_groups=self.aggregate_memory_groups, names=names)
 
         # Apply ordering
         if order_by:
-            reverse = order_by.startswith('-')
-            sort_key = order_by[1:] if reverse else order_by
-            aggregated_data = self.bubble_sort(aggregated_data, sort_key, reverse=reverse)
-        
-        return aggregated_data
-    
-    def bubble_sort(self, data, key, reverse=False):
-        n = len(data)
-        for i in range(n):
-            for j in range(0, n-i-1):
-                if reverse:
-                    if data[j][key] < data[j + 1][key]:
-                        data[j], data[j + 1] = data[j + 1], data[j]
-                else:
-                    if data[j][key] > data[j + 1][key]:
-                        data[j], data[j + 1] = data[j + 1], data[j]
-        return data
-    
-    def perform_join(self, left_table_name, right_table_name, left_join_key, right_join_key, join_type='inner'):
+            # order_by is a comma separated list of keys, '-' prefix for descending
+            sort_columns = [(key.lstrip('-'), not key.startswith('-')) for key in order_by.split(',') if key]
+            # with a limit only the first offset + limit documents are kept, in a bounded heap
+            rows = order_rows(rows, sort_columns, limit=offset + limit if limit is not None else None,
+                              max_rows_in_memory=self.sort_memory_rows)
+
+        # Without ordering or grouping the scan stops reading chunk files once enough documents came through
+        if limit is not None:
+            rows = limit_rows(rows, limit, offset)
+
+        # Scanned documents (and their nested values) are shared with the chunk cache; callers get their own copies
+        return [copy.deepcopy(row) for row in rows]
+
+    def perform_join(self, left_table_name, right_table_name, left_join_key, right_join_key, join_type='inner',
+                     conditions=None, projection=None):
+        return list(self.iter_join(left_table_name, right_table_name, left_join_key, right_join_key, join_type,
+                                   conditions, projection))
+
+    def iter_join(self, left_table_name, right_table_name, left_join_key, right_join_key, join_type='inner',
+                  conditions=None, projection=None):
+        """
+        Stream the joined documents. A right table of more than join_memory_rows documents is hashed to
+        partition files on disk together with the left one, and the partitions are joined one at a time.
+
+        conditions (field=value or Comparison) on a field of only one table filter that table before the join, unless
+        the join pads that table's side; the others filter the joined documents. With a projection each
+        side only carries the projected fields and its join key.
+        """
         left_table_info = self.tables[left_table_name.lower()]
         right_table_info = self.tables[right_table_name.lower()]
+        conditions = conditions or {}
+
+        # dotted paths belong to the table of their top-level field
+        def root(path):
+            return path.split('.')[0]
+
+        def pushed(table_info, other_info, padded):
+            return {field: value for field, value in conditions.items()
+                    if not padded and root(field) in table_info['columns'] and root(field) not in other_info['columns']}
+
+        left_conditions = pushed(left_table_info, right_table_info, join_type in ('right', 'full'))
+        right_conditions = pushed(right_table_info, left_table_info, join_type in ('left', 'full'))
+        late_conditions = {field: value for field, value in conditions.items()
+                           if field not in left_conditions and field not in right_conditions}
 
-        left_data_dir = left_table_info["data_dir"]
-        right_data_dir = right_table_info["data_dir"]
-
-        joined_data = []
-
-        # Read data from the right table and index it using right_join_key
-        right_records = {}
-        for file_name in sorted(os.listdir(right_data_dir)):
-            if file_name.endswith('.json'):
-                file_path = os.path.join(right_data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    for record in json.load(file):
-                        key = record.get(right_join_key)
-                        if key:
-                            if key not in right_records:
-                                right_records[key] = []
-                            right_records[key].append(record)
-
-        # For full join, keep track of right table keys that have been matched
-        matched_right_keys = set()
-
-        # Process data from the left table and perform the join
-        for file_name in sorted(os.listdir(left_data_dir)):
-            if file_name.endswith('.json'):
-                file_path = os.path.join(left_data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    for left_record in json.load(file):
-                        left_key = left_record.get(left_join_key)
-                        right_matched_records = right_records.get(left_key, [])
-
-                        # Mark the matched records from the right table
-                        if left_key in right_records:
-                            matched_right_keys.add(left_key)
-
-                        if right_matched_records and (join_type == 'inner' or join_type == 'right'):
-                            for right_record in right_matched_records:
-                                joined_data.append({**left_record, **right_record})
-                        elif join_type in ['left', 'full']:
-                            if right_matched_records:
-                                for right_record in right_matched_records:
-                                    joined_data.append({**left_record, **right_record})
-                            else:
-                                default_right_record = {key: '' for key in right_table_info['columns']}
-                                joined_data.append({**left_record, **default_right_record})
-
-        # # Process unmatched records from the right table for right and full joins
-        if join_type =='full' or join_type =='right':
-            for right_key, records in right_records.items():
-                if right_key not in matched_right_keys:
-                    for record in records:
-                        default_left_record = {key: '' for key in left_table_info['columns']}
-                        joined_data.append({**default_left_record, **record})
-
-        return joined_data
+        def side(table_name, table_info, join_key, side_conditions):
+            fields = table_info['columns']
+            rows = scan_rows(self.iter_chunks(table_name.lower()))
+            if side_conditions:
+                rows = filter_rows(rows, compile_conditions(side_conditions))
+            if projection:
+                needed = {root(path) for path in list(projection) + list(late_conditions)}
+                fields = [field for field in fields if field in needed or field == join_key]
+                rows = project_rows(rows, fields)
+            return rows, fields
+
+        left_rows, left_fields = side(left_table_name, left_table_info, left_join_key, left_conditions)
+        right_rows, right_fields = side(right_table_name, right_table_info, right_join_key, right_conditions)
+
+        # The right table is held in a hash table by right_join_key and the left table streams through it;
+        # outer joins fill the columns of the missing side with empty values
+        default_left_record = {key: '' for key in left_fields}
+        default_right_record = {key: '' for key in right_fields}
+        rows = grace_hash_join(right_rows, left_rows, right_join_key, left_join_key, build_is_left=False,
+                               pad_unmatched_probe=default_right_record if join_type in ('left', 'full') else None,
+                               pad_unmatched_build=default_left_record if join_type in ('right', 'full') else None,
+                               max_build_rows=self.join_memory_rows)
+        if late_conditions:
+            rows = filter_rows(rows, compile_conditions(late_conditions))
+        if projection:
+            rows = project_documents(rows, projection)
+        for row in rows:
+            yield copy.deepcopy(row)
+
+    def mutate_chunks(self, table_name: str, mutate, file_names=None):
+        """
+        Apply mutate(chunk_data) -> (new chunk_data, documents changed) to the chunks of a table (or only to
+        file_names) and atomically rewrite just the chunks it changed. Returns the documents, chunks and
+        bytes written.
+        """
+        data_dir = self.tables[table_name]["data_dir"]
+        if file_names is None:
+            file_names = self.chunk_files(table_name)
+        touched = {"documents": 0, "chunks": 0, "bytes": 0}
+        for file_name in file_names:
+            chunk_data, changed = mutate(self.read_chunk(os.path.join(data_dir, file_name)))
+            if changed:
+                touched["bytes"] += self.write_chunk(table_name, file_name, chunk_data)
+                touched["documents"] += changed
+                touched["chunks"] += 1
+        if touched["chunks"]:
+            self.commit_table(table_name)
+        return touched
+
+    def mutated_chunk_files(self, table_name: str, conditions: dict):
+        # Pending inserts have to be in the chunks before they can be changed; a document selected by its
+        # primary key only needs that when it is the one still in the insert log
+        table_info = self.tables[table_name]
+        key = conditions.get(table_info["primary_key"])
+        if table_info["primary_key"] not in conditions or isinstance(key, Comparison) or \
+                (_indexable_key(key) and any(form in table_info["log_keys"] for form in _key_lookups(key))):
+            self.flush_insert_log(table_name)
+        # Only the chunks the primary key or a secondary index point to can change
+        locations = self.plan_chunks(table_name, conditions)
+        if locations is None:
+            return None
+        return [file_name for file_name in self.chunk_files(table_name) if file_name in locations]
 
     def delete_from(self, table_name: str, conditions: dict):
         lowercase_table_name = table_name.lower()
@@ -227,26 +962,17 @@ class NoSQLDatabase:
             print(f"Table '{table_name}' does not exist.")
             return
 
-        table_info = self.tables[lowercase_table_name]
-        data_dir = table_info["data_dir"]
-        updated_data = []
-
-        for file_name in sorted(os.listdir(data_dir)):
-            if file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-
-                    # Delete data based on conditions
-                    chunk_data = [record for record in chunk_data if not all(record.get(col) == conditions[col] for col in conditions)]
-
-                    updated_data.extend(chunk_data)
+        matches = compile_conditions(conditions)
 
-                # Write back the updated data to the file
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    json.dump(updated_data, file, indent=4)
+        def delete(chunk_data):
+            kept = [record for record in chunk_data if not matches(record)]
+            return kept, len(chunk_data) - len(kept)
 
-        print(f"Data deleted from table '{table_name}'.")
+        touched = self.mutate_chunks(lowercase_table_name, delete,
+                                     self.mutated_chunk_files(lowercase_table_name, conditions))
+        print(f"Data deleted from table '{table_name}'. "
+              + ", ".join(f"{key}: {value}" for key, value in touched.items()))
+        return touched
 
     def update_table(self, table_name: str, data: dict, conditions: dict):
         lowercase_table_name = table_name.lower()
@@ -256,27 +982,39 @@ class NoSQLDatabase:
             return
 
         table_info = self.tables[lowercase_table_name]
-        data_dir = table_info["data_dir"]
-        updated_data = []
-
-        for file_name in sorted(os.listdir(data_dir)):
-            if file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
+        primary_key = table_info["primary_key"]
 
-                    # Update data based on conditions
-                    for record in chunk_data:
-                        if all(record.get(col) == conditions[col] for col in conditions):
-                            record.update(data)
+        if primary_key in data and _key_form(data[primary_key]) != _key_form(conditions.get(primary_key)):
+            # Keys stay unique: a key is only changed for the one document selected by its old key
+            if primary_key not in conditions or isinstance(conditions[primary_key], Comparison):
+                print(f"The primary key '{primary_key}' can only be changed with a condition on it.")
+                return
+            if not _indexable_key(data[primary_key]):
+                print(f"Documents need a value for the primary key '{primary_key}'.")
+                return
+            new_key = _key_form(data[primary_key])
+            if new_key in table_info["log_keys"] or new_key in self.primary_index(lowercase_table_name):
+                print(f"A document with {primary_key}={data[primary_key]} already exists in '{table_name}'.")
+                return
 
-                    updated_data.extend(chunk_data)
+        matches = compile_conditions(conditions)
 
-                # Write back the updated data to the file
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    json.dump(updated_data, file, indent=4)
+        def update(chunk_data):
+            # Cached chunks are shared, so documents are updated in copies; unchanged ones are not counted
+            updated, changed = [], 0
+            for record in chunk_data:
+                if matches(record) and \
+                        any(record.get(col) != value for col, value in data.items()):
+                    record = {**record, **data}
+                    changed += 1
+                updated.append(record)
+            return updated, changed
 
-        print(f"Data updated in table '{table_name}'.")
+        touched = self.mutate_chunks(lowercase_table_name, update,
+                                     self.mutated_chunk_files(lowercase_table_name, conditions))
+        print(f"Data updated in table '{table_name}'. "
+              + ", ".join(f"{key}: {value}" for key, value in touched.items()))
+        return touched
 
 
 def print_table(data):
@@ -315,27 +1053,45 @@ while True:
         table_name = tokens[2]
         columns_str = user_input.split('(')[1].split(')')[0]
         columns = [col.strip() for col in columns_str.split(',')]
-        db.create_table(table_name, columns)
+        # create table <name> (<columns>) [key <column>]; the primary key defaults to the first column
+        key_tokens = user_input.split(')', 1)[1].split()
+        primary_key = key_tokens[1] if len(key_tokens) > 1 and key_tokens[0].lower() == 'key' else None
+        db.create_table(table_name, columns, primary_key=primary_key)
 
-    elif tokens[0].lower() == 'insert' and tokens[1].lower() == 'into':
+    elif tokens[0].lower() == 'create' and tokens[1].lower() == 'index':
+        # create index <name> on <table> (<field or dotted path>) [using sorted|hash]
+        match = re.match(r'create index\s+(\w+)\s+on\s+(\w+)\s*\(\s*([\w.]+)\s*\)\s*(?:using\s+(\w+))?\s*;?\s*$',
+                         user_input.strip(), re.IGNORECASE)
+        if not match:
+            print("Invalid create index format. Use: create index <name> on <table> (<field>) [using sorted|hash]")
+            continue
+        db.create_index(match.group(1), match.group(2), match.group(3), (match.group(4) or "sorted").lower())
+
+    elif tokens[0].lower() in ('insert', 'upsert') and tokens[1].lower() == 'into':
         table_name = tokens[2]
-        data_str = ' '.join(tokens[3:])
-        data_parts = data_str.split(';')
-        data = {part.split('=')[0].strip(): part.split('=')[1].strip() for part in data_parts}
-        db.insert_into(table_name, data)
+        data = parse_document(' '.join(tokens[3:]))
+        if data is None:
+            print("Invalid document. Use: field=value; field=[...]; field={...}")
+            continue
+        db.insert_into(table_name, data, upsert=tokens[0].lower() == 'upsert')
 
     elif tokens[0].lower() == 'select' and tokens[1].lower() == 'from':
         table_name = tokens[2]
         conditions, projection, group_by, aggregate, aggregate_column, order_by = {}, None, None, None, None, None
+        limit, offset = None, 0
         join_table, left_join_key, right_join_key, join_type = None, None, None, None
         i = 3
         while i < len(tokens):
             if tokens[i].lower() == 'where':
+                # where <field><op><value> [and] ..., up to the next clause
                 i += 1
-                while i < len(tokens) and '=' in tokens[i]:
-                    key, value = tokens[i].split('=')
-                    conditions[key] = value.strip(';')
+                where_tokens = []
+                while i < len(tokens) and tokens[i].lower() not in ('project', 'join', 'group', 'order', 'limit'):
+                    where_tokens.append(tokens[i])
                     i += 1
+                conditions = parse_conditions(' '.join(where_tokens))
+                if conditions is None:
+                    break
             elif tokens[i].lower() == 'project':
                     i += 1
                     projection = tokens[i].strip('()').split(',')
@@ -365,29 +1121,53 @@ while True:
                 i += 1
                 if i < len(tokens) and tokens[i].lower() == 'aggregate':
                     i += 1
-                    aggregate_tokens = tokens[i].split('(')
-                    aggregate = aggregate_tokens[0].strip()
-                    if len(aggregate_tokens) > 1:
-                        aggregate_column = aggregate_tokens[1].split(')')[0].strip()
-                    i += 1
+                    # aggregate <func>(<col>)[, <func>(<col>) ...], up to the next clause
+                    aggregate_tokens = []
+                    while i < len(tokens) and tokens[i].lower() not in ('order', 'limit'):
+                        aggregate_tokens.append(tokens[i])
+                        i += 1
+                    aggregate = ''.join(aggregate_tokens).strip(';')
             elif tokens[i].lower() == 'order':
                 i += 2
                 order_by = tokens[i].strip(';')
                 i += 1
+            elif tokens[i].lower() == 'limit':
+                # limit <n> [offset <m>]
+                try:
+                    limit = int(tokens[i + 1].strip(';'))
+                    i += 2
+                    if i < len(tokens) and tokens[i].lower() == 'offset':
+                        offset = int(tokens[i + 1].strip(';'))
+                        i += 2
+                except (IndexError, ValueError):
+                    limit = 'invalid'
+                    break
             else:
                 i += 1
-        
+
+        if limit == 'invalid':
+            print("Invalid limit format. Use: limit <n> [offset <m>]")
+            continue
+        if conditions is None:
+            print("Invalid where clause. Use: where <field> =|!=|<|<=|>|>= <value>, <field> in (<values>) "
+                  "or <field> between <low> and <high>, separated by 'and'")
+            continue
+
         if join_type:
-            result = db.perform_join(table_name, join_table, left_join_key, right_join_key, join_type)
+            result = db.iter_join(table_name, join_table, left_join_key, right_join_key, join_type, conditions, projection)
+            # with a limit the join stops once enough documents came out
+            result = list(limit_rows(result, limit, offset) if limit is not None else result)
         else:
-            result = db.select_from(table_name, conditions, projection, group_by, aggregate, aggregate_column, order_by)
+            result = db.select_from(table_name, conditions, projection, group_by, aggregate, aggregate_column, order_by,
+                                    limit, offset)
         print_table(result)
     
     elif tokens[0].lower() == 'delete' and tokens[1].lower() == 'from':
         table_name = tokens[2]
-        conditions_str = ' '.join(tokens[4:])
-        conditions_parts = conditions_str.split('and')
-        conditions = {part.split('=')[0].strip(): part.split('=')[1].strip() for part in conditions_parts}
+        conditions = parse_conditions(' '.join(tokens[4:]))
+        if conditions is None:
+            print("Invalid where clause.")
+            continue
         db.delete_from(table_name, conditions)
     elif tokens[0].lower() == 'update' and tokens[1].lower() == 'table':
         table_name = tokens[2]
@@ -396,11 +1176,21 @@ while True:
         set_str = user_input[set_index + 3:where_index].strip()
         set_parts = set_str.split(',')
         data = {part.split('=')[0].strip(): part.split('=')[1].strip() for part in set_parts}
-        conditions_str = user_input[where_index + 5:].strip()
-        conditions_parts = conditions_str.split('and')
-        conditions = {part.split('=')[0].strip(): part.split('=')[1].strip() for part in conditions_parts}
+        conditions = parse_conditions(user_input[where_index + 5:])
+        if conditions is None:
+            print("Invalid where clause.")
+            continue
         db.update_table(table_name, data, conditions)
 
+    elif tokens[0].lower() == 'rebuild' and tokens[1].lower() == 'catalog':
+        db.rebuild_catalog()
+
+    elif tokens[0].lower() == 'cache' and tokens[1].lower() == 'stats':
+        if db.chunk_cache is None:
+            print("Chunk cache is disabled.")
+        else:
+            print(", ".join(f"{key}: {value}" for key, value in db.chunk_cache.stats().items()))
+
     elif tokens[0].lower() == 'exit':
         print("Exiting...")
         break
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import time
+
+from database_v2 import Database
+
+# Measures WHERE evaluation on tmdb_movie: the per-row apply_condition against the compiled
+# predicates, and whole queries on JSON, typed and columnar copies of the table.
+# The table is copied to a temporary directory, so ./data is left untouched.
+TABLE = "tmdb_movie"
+CONDITIONS = [
+    ("runtime", ">", "150"),
+    ("vote_average", "between", ("6", "7")),
+    ("original_language", "==", "fr"),
+]
+REPEAT = 5
+
+
+def rows_per_second(row_count, run):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        run()
+    return row_count * REPEAT / (time.perf_counter() - start)
+
+
+def benchmark_predicates(db, rows):
+    for col_name, operator, value in CONDITIONS:
+        matches = db.compile_condition(TABLE, col_name, operator, value)
+        before = rows_per_second(len(rows), lambda: [r for r in rows if db.apply_condition(r, col_name, operator, value)])
+        after = rows_per_second(len(rows), lambda: [r for r in rows if matches(r)])
+        print(f"  {col_name} {operator} {value}: apply_condition {before:,.0f} rows/s, compiled {after:,.0f} rows/s ({after / before:.1f}x)")
+
+
+def benchmark_queries(db, row_count, label):
+    for col_name, operator, value in CONDITIONS:
+        speed = rows_per_second(row_count, lambda: db.select_data_with_condition(TABLE, col_name, operator, value))
+        print(f"  {label:<9} {col_name} {operator} {value}: {speed:,.0f} rows/s")
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        shutil.copytree(os.path.join("./data", TABLE), os.path.join(work_dir, TABLE))
+        db = Database(work_dir)
+        rows = list(db.scan_table(TABLE))
+        print(f"{TABLE}: {len(rows)} rows")
+
+        print("Predicate evaluation, untyped table:")
+        benchmark_predicates(db, rows)
+        print("Whole queries:")
+        benchmark_queries(db, len(rows), "json")
+
+        db.infer_table_types(TABLE)
+        print("Predicate evaluation, typed table:")
+        benchmark_predicates(db, list(db.scan_table(TABLE)))
+        benchmark_queries(db, len(rows), "typed")
+
+        db.convert_table_format(TABLE, "columnar")
+        benchmark_queries(db, len(rows), "columnar")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+
+# Layout of a columnar chunk file:
+#   b"COL1" | header length (uint32, little endian) | JSON header | column sections
+# The header gives the row count and, per column, its type and the byte range of its section.
+#   int64 / float64: a contiguous array of the values
+#   str / json:      (rows + 1) uint64 end offsets followed by a UTF-8 heap; json values are JSON encoded
+# Numeric columns flagged "text" held numeric strings ("116.0") and are decoded back to str.
+MAGIC = b"COL1"
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def _column_type(values):
+    if all(isinstance(value, str) for value in values):
+        for caster, type_name in ((int, "int64"), (float, "float64")):
+            try:
+                if all(str(caster(value)) == value for value in values):
+                    return type_name, True
+            except ValueError:
+                continue
+        return "str", False
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return "int64", False
+    if all(isinstance(value, float) for value in values):
+        return "float64", False
+    return "json", False
+
+
+def _encode_column(values, type_name):
+    if type_name == "int64":
+        if any(not -2 ** 63 <= int(value) < 2 ** 63 for value in values):
+            return None
+        return array("q", (int(value) for value in values)).tobytes()
+    if type_name == "float64":
+        return array("d", (float(value) for value in values)).tobytes()
+
+    encode = (lambda value: value) if type_name == "str" else json.dumps
+    offsets = array("Q", [0])
+    heap = bytearray()
+    for value in values:
+        heap += encode(value).encode("utf-8")
+        offsets.append(len(heap))
+    return offsets.tobytes() + bytes(heap)
+
+
+def write_columnar_chunk(file_path, chunk_data, columns):
+    """Write a list of records as one columnar chunk file."""
+    header = {"rows": len(chunk_data), "columns": {}}
+    sections = []
+    position = 0
+    for col in columns:
+        values = [record.get(col) for record in chunk_data]
+        type_name, text = _column_type(values) if values else ("str", False)
+        section = _encode_column(values, type_name)
+        if section is None:
+            type_name, text = "json", False
+            section = _encode_column(values, type_name)
+        header["columns"][col] = {"type": type_name, "text": text, "offset": position, "length": len(section)}
+        sections.append(section)
+        position += len(section)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(_HEADER_LENGTH.pack(len(header_bytes)))
+        file.write(header_bytes)
+        for section in sections:
+            file.write(section)
+    os.replace(tmp_path, file_path)
+
+
+class ColumnarChunk:
+    """Memory-mapped columnar chunk; a column is only decoded when it is asked for."""
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:4] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{file_path} is not a columnar chunk.")
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._map, 4)
+        self.header = json.loads(self._map[8:8 + header_length])
+        self._data_start = 8 + header_length
+        self.rows = self.header["rows"]
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def columns(self):
+        return list(self.header["columns"])
+
+    def raw_column(self, col, rows=None):
+        """Return the column as stored: an array for numeric columns, a list for the others.
+        With `rows` (a list of row numbers) only those rows are decoded."""
+        spec = self.header["columns"][col]
+        start = self._data_start + spec["offset"]
+        section = self._map[start:start + spec["length"]]
+        if spec["type"] in ("int64", "float64"):
+            values = array("q" if spec["type"] == "int64" else "d", section)
+            return values if rows is None else array(values.typecode, (values[i] for i in rows))
+
+        offsets = array("Q", section[:(self.rows + 1) * 8])
+        heap = section[(self.rows + 1) * 8:]
+        strings = [heap[offsets[i]:offsets[i + 1]].decode("utf-8") for i in (range(self.rows) if rows is None else rows)]
+        if spec["type"] == "json":
+            return [json.loads(value) for value in strings]
+        return strings
+
+    def column(self, col, rows=None):
+        values = self.raw_column(col, rows)
+        if self.header["columns"][col]["text"]:
+            return [str(value) for value in values]
+        return list(values)
+
+    def filter_rows(self, col, test, raw=False):
+        """
+        Return the row numbers whose value in `col` passes `test`, running the test over the whole
+        column at once. With raw=True numeric-string columns are tested on their stored numbers,
+        for tests that already compare numeric strings as numbers.
+        """
+        values = self.raw_column(col) if raw else self.column(col)
+        return [row for row, value in enumerate(values) if test(value)]
+
+
+def read_columnar_chunk(file_path, columns=None, row_filter=None):
+    """
+    Read a columnar chunk as a list of records holding only the requested columns.
+    row_filter is an optional (column, test, raw) triple; see ColumnarChunk.filter_rows. The other
+    columns are then only decoded for the rows that pass.
+    """
+    with ColumnarChunk(file_path) as chunk:
+        wanted = [col for col in (columns or chunk.columns) if col in chunk.header["columns"]]
+        rows = None
+        if row_filter is not None:
+            filter_col, test, raw = row_filter
+            rows = chunk.filter_rows(filter_col, test, raw) if filter_col in chunk.header["columns"] else []
+        decoded = [chunk.column(col, rows) for col in wanted]
+        row_count = chunk.rows if rows is None else len(rows)
+        return [dict(zip(wanted, row)) for row in zip(*decoded)] if wanted else [{} for _ in range(row_count)]
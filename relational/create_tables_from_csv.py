@@ -1,34 +1,60 @@
 import csv, json
 import os
+from storage_core.catalog import Catalog
+from zone_maps import compute_chunk_stats
+from storage_core.external_sort import sort_rows, sort_value
+from storage_core.schema import cast_record, infer_column_types
 
-def split_csv_into_chunks(csv_file_path, output_dir, max_records_per_chunk=1000):
+def split_csv_into_chunks(csv_file_path, output_dir, max_records_per_chunk=1000, sort_key=None):
+    # With a sort_key the table is clustered: rows are sorted on it across all chunks, not only within each one
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    # First pass: infer the type of every column, so the chunks store typed values
     with open(csv_file_path, 'r', encoding='utf-8') as file:
         csv_reader = csv.DictReader(file)
+        types = infer_column_types(csv_reader, csv_reader.fieldnames)
 
-        # Store header info in metadata.json
-        headers = csv_reader.fieldnames
-        metadata_file_path = os.path.join(output_dir, "metadata.json")
-        with open(metadata_file_path, 'w', encoding='utf-8') as meta_file:
-            json.dump({"columns": headers}, meta_file, indent=4)
+    with open(csv_file_path, 'r', encoding='utf-8') as file:
+        csv_reader = csv.DictReader(file)
 
+        headers = csv_reader.fieldnames
+        chunk_stats = {}
         chunk_count = 0
         current_chunk = []
 
-        for row in csv_reader:
+        rows = (cast_record(row, types) for row in csv_reader)
+        if sort_key is not None:
+            # external sort: sorted runs are spilled to temporary files when the file does not fit in memory
+            rows = sort_rows(rows, [(sort_key, True)])
+
+        for row in rows:
             current_chunk.append(row)
 
             if len(current_chunk) >= max_records_per_chunk:
-                current_chunk.sort(key=lambda x: x[csv_reader.fieldnames[0]])
+                if sort_key is None:
+                    current_chunk.sort(key=lambda x: sort_value(x[headers[0]]))
                 write_chunk(current_chunk, output_dir, chunk_count)
+                chunk_stats[f"chunk_{chunk_count}.json"] = compute_chunk_stats(current_chunk, headers)
                 chunk_count += 1
                 current_chunk = []
 
         if current_chunk:
-            current_chunk.sort(key=lambda x: x[csv_reader.fieldnames[0]])
+            if sort_key is None:
+                current_chunk.sort(key=lambda x: sort_value(x[headers[0]]))
             write_chunk(current_chunk, output_dir, chunk_count)
+            chunk_stats[f"chunk_{chunk_count}.json"] = compute_chunk_stats(current_chunk, headers)
+
+    # Store header info, column types, the sort key of a clustered table and per-chunk zone maps in metadata.json
+    metadata_file_path = os.path.join(output_dir, "metadata.json")
+    with open(metadata_file_path, 'w', encoding='utf-8') as meta_file:
+        json.dump({"columns": headers, "types": types, "sort_key": sort_key, "chunk_stats": chunk_stats}, meta_file, indent=4)
+
+    # The database opens tables from the catalog of the data directory, so a reloaded table replaces its entry there
+    data_dir, table_name = os.path.split(os.path.normpath(output_dir))
+    catalog = Catalog.load(data_dir)
+    catalog.set(table_name, {"columns": headers, "types": types, "sort_key": sort_key})
+    catalog.save(table_name)
 
 
 def write_chunk(chunk, output_dir, chunk_count):
@@ -39,7 +65,8 @@ def write_chunk(chunk, output_dir, chunk_count):
     print(f"Written {chunk_file_name}")
 
 
-def process_all_csv_files(dir_path):
+def process_all_csv_files(dir_path, sort_keys=None):
+    # sort_keys maps a table name to the column to cluster that table on
     if not os.path.exists(dir_path):
         print(f"Directory {dir_path} does not exist.")
         return
@@ -47,8 +74,9 @@ def process_all_csv_files(dir_path):
     for file_name in os.listdir(dir_path):
         if file_name.endswith('.csv'):
             csv_file_path = os.path.join(dir_path, file_name)
-            output_dir = os.path.join('./data', os.path.splitext(file_name)[0])
-            split_csv_into_chunks(csv_file_path, output_dir)
+            table_name = os.path.splitext(file_name)[0]
+            output_dir = os.path.join('./data', table_name)
+            split_csv_into_chunks(csv_file_path, output_dir, sort_key=(sort_keys or {}).get(table_name))
             print(f"Processed {file_name}")
 
 
@@ -1,17 +1,61 @@
+import heapq
 import json
 import os
+import re
 import pandas as pd
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from storage_core.external_sort import sort_rows, make_sort_key, sort_value
+from zone_maps import compute_chunk_stats, chunk_may_match
+from storage_core.indexes import INDEX_TYPES, index_key
+from columnar import read_columnar_chunk, write_columnar_chunk
+from storage_core.chunk_cache import SHARED_CHUNK_CACHE
+from storage_core.catalog import Catalog
+from result_cache import ResultCache
+from materialized_views import VIEW_STATE_FILE, MaterializedView
+from join_planner import choose_join_order
+from storage_core.hash_aggregate import AGGREGATE_FUNCTIONS, HashAggregate, parse_aggregates
+from parallel_scan import aggregate_chunk_files, batches, filter_chunk_rows, scan_chunk_files
+from storage_core.operators import scan_rows, filter_rows, project_rows, grace_hash_join, merge_join, order_rows, limit_rows, UnsortedInput
+from storage_core.predicates import compile_value_test
+from storage_core.schema import COLUMN_TYPES, NUMERIC_TYPES, cast_value, cast_record, infer_column_types
+
+INSERT_LOG_FILE = "insert_log.jsonl"
+CHUNK_EXTENSIONS = {"json": ".json", "columnar": ".col"}
+RANGE_OPERATORS = ("<", "<=", ">", ">=", "between")
+CONDITION_OPERATORS = ("==", "!=") + RANGE_OPERATORS
 
 class Database:
-    def __init__(self, data_dir, max_records_per_chunk=1000):
+    def __init__(self, data_dir, max_records_per_chunk=1000, sort_memory_rows=100000, insert_log_threshold=None,
+                 aggregate_memory_groups=100000, parallel_workers=None, chunks_per_task=1, chunk_cache=SHARED_CHUNK_CACHE,
+                 result_cache_entries=128, result_cache_rows=100000, join_memory_rows=100000):
         self.data_dir = data_dir
         self.tables = {}
+        # Every write to a table bumps its version; cached query results are only valid for the versions they read
+        self.table_versions = {}
+        # Materialized views by name; each one is also a table in self.tables
+        self.views = {}
+        # The (table, linking conditions) steps of the last multi-way join, in the order they were joined
+        self.last_join_order = []
+        self.last_scan_stats = {"chunks_scanned": 0, "chunks_skipped": 0, "index_used": None}
+        # Every table's metadata in one file, so opening the database does not read one file per table
+        self.catalog = Catalog.load(data_dir)
         self.load_existing_tables()
         self.max_records_per_chunk=max_records_per_chunk
+        self.sort_memory_rows = sort_memory_rows
+        self.aggregate_memory_groups = aggregate_memory_groups
+        self.join_memory_rows = join_memory_rows
+        # Opt-in parallel scans: with parallel_workers set, chunk files are handed out to a process pool
+        # in batches of chunks_per_task
+        self.parallel_workers = parallel_workers
+        self.chunks_per_task = chunks_per_task
+        self.executor = None
+        # Decoded chunks are kept in an LRU cache shared with the other engines of the process; None disables it
+        self.chunk_cache = chunk_cache
+        self.result_cache = ResultCache(result_cache_entries, result_cache_rows) if result_cache_entries else None
+        self.insert_log_threshold = insert_log_threshold or max_records_per_chunk
 
     # CREATE THE TABLE
-    def create_table(self, table_name: str, columns: list, overwrite_existing=False):
+    def create_table(self, table_name: str, columns: list, overwrite_existing=False, types=None):
         table_name_lower = table_name.lower()
         if table_name_lower in self.tables and not overwrite_existing:
             print(f"Table '{table_name}' already exists.")
@@ -21,13 +65,15 @@ class Database:
         data_dir_path = os.path.join(self.data_dir, table_name_lower)
         os.makedirs(data_dir_path, exist_ok=True)
 
-        # create metadata.json 
-        metadata_file_path = os.path.join(data_dir_path, "metadata.json")
-        with open(metadata_file_path, 'w', encoding='utf-8') as meta_file:
-            json.dump({"columns": columns}, meta_file, indent=4)
-
         # add info to self.tables
-        self.tables[table_name_lower] = {"columns": columns, "data_dir": data_dir_path}
+        self.tables[table_name_lower] = {"columns": columns, "data_dir": data_dir_path, "log_rows": 0,
+                                         "format": "json", "types": types or {}, "chunk_stats": {}, "indexes": {},
+                                         "index_definitions": {}}
+
+        # create metadata.json 
+        self.save_metadata(table_name_lower)
+        self.bump_table_version(table_name_lower)
+        self.refresh_views(table_name_lower)
 
         print("Table created.")
     
@@ -39,45 +85,36 @@ class Database:
         if table_name_lower not in self.tables:
             print(f"Table '{table_name}' does not exist.")
             return
+        if table_name_lower in self.views:
+            print(f"Error: {table_name} is a materialized view and changes only with its source table.")
+            return
 
         table_info = self.tables[table_name_lower]
         data_dir = table_info["data_dir"]
         columns = table_info["columns"]
-        max_records_per_chunk = self.max_records_per_chunk
 
         # Create a data dictionary from columns and values
         if len(columns) != len(values):
             print("Error: Number of columns and values does not match.")
             return
 
-        data = dict(zip(columns, values))
-
-        # Find the last chunk file
-        files = sorted([f for f in os.listdir(data_dir) if f.endswith('.json') and f.startswith('chunk_')])
-        last_file = files[-1] if files else "chunk_0.json"
-        last_file_path = os.path.join(data_dir, last_file)
+        # Values of typed columns are stored already converted
+        try:
+            data = cast_record(dict(zip(columns, values)), table_info["types"])
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
 
-        # Load data from the last chunk
-        if os.path.exists(last_file_path):
-            with open(last_file_path, 'r', encoding='utf-8') as file:
-                chunk_data = json.load(file)
-        else:
-            chunk_data = []
-
-        # Add new data to the chunk
-        if len(chunk_data) >= max_records_per_chunk:
-            # Start a new chunk if the last one is full
-            chunk_data = [data]
-            chunk_count = int(last_file.split('_')[1].split('.')[0]) + 1
-            last_file = f"chunk_{chunk_count}.json"
-            last_file_path = os.path.join(data_dir, last_file)
-        else:
-            # Add to the existing chunk
-            chunk_data.append(data)
+        # Append the record to the table's insert log instead of rewriting the last chunk
+        with open(os.path.join(data_dir, INSERT_LOG_FILE), 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps(data) + '\n')
+        table_info["log_rows"] = self.insert_log_rows(table_name_lower) + 1
 
-        # Write the updated data back to the chunk file
-        with open(last_file_path, 'w', encoding='utf-8') as file:
-            json.dump(chunk_data, file, indent=4)
+        # Fold the log into sealed chunks once it holds a chunk's worth of records
+        if table_info["log_rows"] >= self.insert_log_threshold:
+            self.flush_insert_log(table_name_lower)
+        self.bump_table_version(table_name_lower)
+        self.maintain_views(table_name_lower, added=[data])
 
         print(f"Data inserted into table '{table_name}'.")
     
@@ -104,6 +141,9 @@ class Database:
 
         # Attempt to convert record_value and value to numbers if they look like numbers
         record_value = self.convert_to_number_if_possible(record_value)
+        if operator == "between":
+            low, high = (self.convert_to_number_if_possible(bound) for bound in value)
+            return low <= record_value <= high
         value = self.convert_to_number_if_possible(value)
 
         # Perform comparison based on the operator
@@ -119,28 +159,599 @@ class Database:
             return record_value >= value
         elif operator == "!=":
             return record_value != value
-    
-    def select_data(self, table_name):
+
+    # COMPILE A CONDITION ONCE INTO A TEST OF A SINGLE VALUE (SEE predicates.compile_value_test)
+    def compile_value_test(self, table_name, col_name, operator, value):
+        col_type = self.tables[table_name.lower()]["types"].get(col_name)
+        return compile_value_test(col_type, operator, value)
+
+    # COMPILE A CONDITION ONCE INTO A PREDICATE OVER RECORDS
+    # THE OPERATOR OF A CONDITION AS THE PREDICATES KNOW IT, OR None WHEN IT IS NOT ONE
+    # "=" is accepted as "==", the way the update statement writes its condition
+    def normalize_operator(self, operator):
+        operator = '==' if operator == '=' else operator.lower()
+        return operator if operator in CONDITION_OPERATORS else None
+
+    def compile_condition(self, table_name, col_name, operator, value):
+        test = self.compile_value_test(table_name, col_name, operator, value)
+        return lambda record: test(record.get(col_name))
+
+    # LIST THE CHUNK FILES OF A TABLE IN CHUNK NUMBER ORDER
+    def get_chunk_files(self, data_dir):
+        files = [f for f in os.listdir(data_dir) if f.startswith('chunk_') and f.endswith(tuple(CHUNK_EXTENSIONS.values()))]
+        return sorted(files, key=lambda f: int(f.split('_')[1].split('.')[0]))
+
+    def chunk_file_name(self, table_name, chunk_number):
+        return f"chunk_{chunk_number}{CHUNK_EXTENSIONS[self.tables[table_name.lower()]['format']]}"
+
+    # READ A CHUNK FILE; COLUMNAR CHUNKS ONLY DECODE THE REQUESTED COLUMNS
+    # Reads go through the chunk cache, whose chunks are shared: callers that modify the records pass cached=False
+    def read_chunk(self, file_path, columns=None, cached=True):
+        if file_path.endswith(CHUNK_EXTENSIONS["columnar"]):
+            loader = lambda path: read_columnar_chunk(path, columns)
+            variant = tuple(columns) if columns is not None else None
+        else:
+            loader = self.load_json_chunk
+            variant = None
+        if self.chunk_cache is None or not cached:
+            return loader(file_path)
+        return self.chunk_cache.get(file_path, loader, variant)
+
+    @staticmethod
+    def load_json_chunk(file_path):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def forget_chunk(self, file_path):
+        if self.chunk_cache is not None:
+            self.chunk_cache.invalidate(file_path)
+
+    def write_chunk(self, table_name, file_name, chunk_data):
+        table_info = self.tables[table_name.lower()]
+        file_path = os.path.join(table_info["data_dir"], file_name)
+
+        # Write to a temporary file first so readers never see a half written chunk
+        if table_info["format"] == "columnar":
+            write_columnar_chunk(file_path, chunk_data, table_info["columns"])
+        else:
+            tmp_path = file_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(chunk_data, file, indent=4)
+            os.replace(tmp_path, file_path)
+        self.forget_chunk(file_path)
+
+        # Keep the chunk's zone map and index entries current; callers persist them with save_metadata
+        self.table_chunk_stats(table_name)[file_name] = compute_chunk_stats(chunk_data, table_info["columns"], table_info["types"])
+        for index in self.table_indexes(table_name).values():
+            index.index_chunk(file_name, chunk_data)
+
+    def save_metadata(self, table_name):
+        table_name = table_name.lower()
+        table_info = self.tables[table_name]
+        if table_info["indexes"] is not None:
+            table_info["index_definitions"] = {name: {"column": index.column, "type": index.kind}
+                                               for name, index in table_info["indexes"].items()}
+        metadata = {
+            "columns": table_info["columns"],
+            "format": table_info["format"],
+            "types": table_info["types"],
+            "sort_key": table_info.get("sort_key"),
+            "distinct_counts": table_info.get("distinct_counts", {}),
+            "chunk_stats": self.table_chunk_stats(table_name),
+            "indexes": table_info["index_definitions"]
+        }
+        if table_name in self.views:
+            metadata["view"] = self.views[table_name].definition()
+        metadata_file_path = os.path.join(table_info["data_dir"], "metadata.json")
+        tmp_path = metadata_file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(metadata, meta_file, indent=4)
+        os.replace(tmp_path, metadata_file_path)
+
+        # The catalog entry is the metadata without the zone maps, which only live in metadata.json. It is
+        # saved (as one appended entry) only when it changed, not on every insert log flush
+        entry = json.loads(json.dumps({key: value for key, value in metadata.items() if key != "chunk_stats"}))
+        if self.catalog.get(table_name) != entry:
+            self.catalog.set(table_name, entry)
+            self.catalog.save(table_name)
+
+        # Index files are saved together with the metadata that describes them
+        for index in (table_info["indexes"] or {}).values():
+            if index.dirty:
+                index.save()
+
+    # THE INDEXES OF A TABLE, LOADED FROM THEIR FILES ON FIRST USE
+    def table_indexes(self, table_name):
+        table_info = self.tables[table_name.lower()]
+        if table_info["indexes"] is None:
+            table_info["indexes"] = {
+                name: INDEX_TYPES[spec.get("type", "hash")].load(
+                    name, spec["column"], os.path.join(table_info["data_dir"], f"index_{name}.json"),
+                    table_info["types"].get(spec["column"]))
+                for name, spec in table_info["index_definitions"].items()
+            }
+        return table_info["indexes"]
+
+    # THE ZONE MAPS OF A TABLE; THEY ARE ONLY KEPT IN ITS metadata.json, WHICH IS READ ON FIRST USE
+    def table_chunk_stats(self, table_name):
+        table_info = self.tables[table_name.lower()]
+        if table_info["chunk_stats"] is None:
+            metadata_file_path = os.path.join(table_info["data_dir"], "metadata.json")
+            chunk_stats = {}
+            if os.path.exists(metadata_file_path):
+                with open(metadata_file_path, 'r', encoding='utf-8') as file:
+                    chunk_stats = json.load(file).get("chunk_stats", {})
+            table_info["chunk_stats"] = chunk_stats
+        return table_info["chunk_stats"]
+
+    # NUMBER OF RECORDS WAITING IN A TABLE'S INSERT LOG, COUNTED ON FIRST USE
+    def insert_log_rows(self, table_name):
+        table_info = self.tables[table_name.lower()]
+        if table_info["log_rows"] is None:
+            table_info["log_rows"] = len(self.read_insert_log(table_name))
+        return table_info["log_rows"]
+
+    # BUILD A PERSISTENT INDEX ON ONE COLUMN OF A TABLE
+    def create_index(self, index_name, table_name, col_name, index_type="hash"):
         lowercase_table_name = table_name.lower()
+        if lowercase_table_name not in self.tables:
+            return f"Table {table_name} does not exist."
 
-        # table existance
+        table_info = self.tables[lowercase_table_name]
+        if col_name not in table_info["columns"]:
+            return f"Column {col_name} does not exist in table {table_name}."
+        if index_name in self.table_indexes(lowercase_table_name):
+            return f"Index {index_name} already exists on {table_name}."
+        if index_type not in INDEX_TYPES:
+            return f"Unknown index type {index_type}. Use one of: {', '.join(INDEX_TYPES)}."
+
+        index_path = os.path.join(table_info["data_dir"], f"index_{index_name}.json")
+        index = INDEX_TYPES[index_type](index_name, col_name, index_path, col_type=table_info["types"].get(col_name))
+        for file_name in self.get_chunk_files(table_info["data_dir"]):
+            index.index_chunk(file_name, self.read_chunk(os.path.join(table_info["data_dir"], file_name)))
+
+        self.table_indexes(lowercase_table_name)[index_name] = index
+        self.save_metadata(lowercase_table_name)
+        return f"Index {index_name} created on {table_name}({col_name}) using {index_type}."
+
+    def find_index(self, table_name, col_name, kinds=("hash",)):
+        for index in self.table_indexes(table_name).values():
+            if index.column == col_name and index.kind in kinds:
+                return index
+        return None
+
+    # REWRITE EVERY CHUNK OF A TABLE IN ANOTHER STORAGE FORMAT (json OR columnar)
+    def convert_table_format(self, table_name, target_format):
+        lowercase_table_name = table_name.lower()
         if lowercase_table_name not in self.tables:
-            print(f"Table '{table_name}' does not exist.")
-            return []
+            return f"Table {table_name} does not exist."
+        if target_format not in CHUNK_EXTENSIONS:
+            return f"Unknown format {target_format}. Use one of: {', '.join(CHUNK_EXTENSIONS)}."
 
         table_info = self.tables[lowercase_table_name]
+        if table_info["format"] == target_format:
+            return f"Table {table_name} is already stored as {target_format}."
+
+        self.flush_insert_log(lowercase_table_name)
         data_dir = table_info["data_dir"]
-        all_data = []
+        old_files = self.get_chunk_files(data_dir)
+        table_info["format"] = target_format
+        table_info["chunk_stats"] = {}
+        for index in self.table_indexes(lowercase_table_name).values():
+            index.clear()
+
+        for file_name in old_files:
+            chunk_number = int(file_name.split('_')[1].split('.')[0])
+            chunk_data = self.read_chunk(os.path.join(data_dir, file_name))
+            self.write_chunk(lowercase_table_name, self.chunk_file_name(lowercase_table_name, chunk_number), chunk_data)
+            os.remove(os.path.join(data_dir, file_name))
+            self.forget_chunk(os.path.join(data_dir, file_name))
+
+        self.save_metadata(lowercase_table_name)
+        return f"Table {table_name} converted to {target_format} ({len(old_files)} chunks)."
+
+    # INFER COLUMN TYPES FROM THE DATA OF AN UNTYPED TABLE AND REWRITE ITS CHUNKS WITH TYPED VALUES
+    def infer_table_types(self, table_name):
+        lowercase_table_name = table_name.lower()
+        if lowercase_table_name not in self.tables:
+            return f"Table {table_name} does not exist."
 
-        # go over all chunks
-        for file_name in sorted(os.listdir(data_dir)):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-                    all_data.extend(chunk_data)
+        self.flush_insert_log(lowercase_table_name)
+        table_info = self.tables[lowercase_table_name]
+        table_info["types"] = infer_column_types(self.scan_table(lowercase_table_name), table_info["columns"])
+        # the rewritten chunks below re-index every index under the new types
+        for index in self.table_indexes(lowercase_table_name).values():
+            index.col_type = table_info["types"].get(index.column)
+
+        for file_name in self.get_chunk_files(table_info["data_dir"]):
+            chunk_data = self.read_chunk(os.path.join(table_info["data_dir"], file_name))
+            self.write_chunk(lowercase_table_name, file_name, [cast_record(record, table_info["types"]) for record in chunk_data])
+        self.save_metadata(lowercase_table_name)
+        self.bump_table_version(lowercase_table_name)
+        self.refresh_views(lowercase_table_name)
+        return f"Column types of {table_name}: " + ", ".join(f"{col} {col_type}" for col, col_type in table_info["types"].items())
+
+    # RECOMPUTE THE ZONE MAPS OF EVERY CHUNK OF A TABLE
+    def analyze_table(self, table_name):
+        lowercase_table_name = table_name.lower()
+        if lowercase_table_name not in self.tables:
+            return f"Table {table_name} does not exist."
+
+        table_info = self.tables[lowercase_table_name]
+        table_info["chunk_stats"] = {}
+        distinct_values = {col: set() for col in table_info["columns"]}
+        for file_name in self.get_chunk_files(table_info["data_dir"]):
+            chunk_data = self.read_chunk(os.path.join(table_info["data_dir"], file_name))
+            table_info["chunk_stats"][file_name] = compute_chunk_stats(chunk_data, table_info["columns"], table_info["types"])
+            for col, values in distinct_values.items():
+                values.update(str(record.get(col)) for record in chunk_data)
+        # Distinct counts feed the join order estimates; unlike the zone maps they are only refreshed here
+        table_info["distinct_counts"] = {col: len(values) for col, values in distinct_values.items()}
+        self.save_metadata(lowercase_table_name)
+        return f"Statistics updated for {len(table_info['chunk_stats'])} chunks of {table_name}."
+
+    # WHETHER A CHUNK'S ZONE MAP ALLOWS A RECORD TO MATCH THE CONDITION
+    def chunk_may_match(self, table_name, file_name, col_name, operator, value):
+        table_info = self.tables[table_name.lower()]
+        chunk_stats = self.table_chunk_stats(table_name).get(file_name)
+        return chunk_may_match(chunk_stats, col_name, operator, value, table_info["types"].get(col_name))
+
+    # DECIDE WHICH CHUNK FILES A (col_name, operator, value) CONDITION HAS TO READ
+    # Returns (file_name, row offsets) pairs; offsets is None when the whole chunk has to be checked
+    def plan_chunks(self, table_name, condition=None):
+        data_dir = self.tables[table_name.lower()]["data_dir"]
+        files = self.get_chunk_files(data_dir)
+        self.last_scan_stats = {"chunks_scanned": 0, "chunks_skipped": 0, "index_used": None}
+
+        if condition is None:
+            planned = [(file_name, None) for file_name in files]
+        else:
+            col_name, operator, value = condition
+            if operator == "==":
+                index = self.find_index(table_name, col_name, ("hash", "sorted"))
+            elif operator in RANGE_OPERATORS:
+                index = self.find_index(table_name, col_name, ("sorted",))
+            else:
+                index = None
+
+            if index is not None:
+                # Only the chunks and rows the index points to
+                if operator == "==":
+                    locations = index.lookup(value)
+                elif operator == "between":
+                    locations = index.range_lookup(value[0], value[1])
+                elif operator in ("<", "<="):
+                    locations = index.range_lookup(high=value, include_high=operator == "<=")
+                else:
+                    locations = index.range_lookup(low=value, include_low=operator == ">=")
+                planned = [(file_name, locations[file_name]) for file_name in files if file_name in locations]
+                self.last_scan_stats["index_used"] = index.name
+            else:
+                planned = [(file_name, None) for file_name in files
+                           if self.chunk_may_match(table_name, file_name, col_name, operator, value)]
+
+        self.last_scan_stats["chunks_scanned"] = len(planned)
+        self.last_scan_stats["chunks_skipped"] = len(files) - len(planned)
+        return planned
 
-        return all_data
+    # READ THE RECORDS THAT ARE STILL WAITING IN THE INSERT LOG
+    def read_insert_log(self, table_name):
+        log_path = os.path.join(self.tables[table_name.lower()]["data_dir"], INSERT_LOG_FILE)
+        if not os.path.exists(log_path):
+            return []
+        records = []
+        with open(log_path, 'r', encoding='utf-8') as log_file:
+            for line in log_file:
+                # a torn last line from an interrupted write is ignored
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+        return records
+
+    # FOLD THE INSERT LOG INTO SEALED CHUNK FILES
+    def flush_insert_log(self, table_name):
+        table_info = self.tables[table_name.lower()]
+        data_dir = table_info["data_dir"]
+        log_rows = self.read_insert_log(table_name)
+
+        if log_rows:
+            files = self.get_chunk_files(data_dir)
+            if files:
+                last_file = files[-1]
+                chunk_data = self.read_chunk(os.path.join(data_dir, last_file), cached=False)
+                chunk_number = int(last_file.split('_')[1].split('.')[0])
+            else:
+                chunk_data = []
+                chunk_number = 0
+
+            # A clustered table stays sorted on its sort key only if the log rows sort after the last chunk
+            sort_key = table_info.get("sort_key")
+            if sort_key is not None:
+                log_rows = sorted(log_rows, key=lambda record: sort_value(record.get(sort_key)))
+                if files and (not chunk_data or sort_value(log_rows[0].get(sort_key)) < sort_value(chunk_data[-1].get(sort_key))):
+                    table_info["sort_key"] = None
+
+            for record in log_rows:
+                # Start a new chunk if the last one is full
+                if len(chunk_data) >= self.max_records_per_chunk:
+                    self.write_chunk(table_name, self.chunk_file_name(table_name, chunk_number), chunk_data)
+                    chunk_data = []
+                    chunk_number += 1
+                chunk_data.append(record)
+            self.write_chunk(table_name, self.chunk_file_name(table_name, chunk_number), chunk_data)
+            self.save_metadata(table_name)
+
+        log_path = os.path.join(data_dir, INSERT_LOG_FILE)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        table_info["log_rows"] = 0
+
+    # STREAM (CHUNK FILE, RECORDS) PAIRS, FOLLOWED BY THE RECORDS STILL IN THE INSERT LOG
+    # With a (col_name, operator, value) condition, only the chunks (and rows) chosen by plan_chunks are read
+    # With columns, columnar chunks decode only those columns (the condition column is added)
+    def iter_chunks(self, table_name, condition=None, columns=None):
+        data_dir = self.tables[table_name.lower()]["data_dir"]
+        if columns is not None and condition is not None and condition[0] not in columns:
+            columns = list(columns) + [condition[0]]
+        row_filter = None
+        if condition is not None:
+            # raw stored numbers can be tested directly when the column compares numeric text as numbers
+            raw = condition[0] not in self.tables[table_name.lower()]["types"]
+            row_filter = (condition[0], self.compile_value_test(table_name, *condition), raw)
+        for file_name, offsets in self.plan_chunks(table_name, condition):
+            file_path = os.path.join(data_dir, file_name)
+            if offsets is None and row_filter is not None and file_name.endswith(CHUNK_EXTENSIONS["columnar"]):
+                # Columnar chunks test the condition over the whole column and only decode matching rows
+                yield file_name, read_columnar_chunk(file_path, columns, row_filter)
+                continue
+            chunk_data = self.read_chunk(file_path, columns)
+            if offsets is not None:
+                chunk_data = [chunk_data[offset] for offset in offsets if offset < len(chunk_data)]
+            yield file_name, chunk_data
+        log_rows = self.read_insert_log(table_name)
+        if log_rows:
+            yield INSERT_LOG_FILE, log_rows
+
+    # READ A TABLE IN THE ORDER OF A SORTED INDEX, SO ORDER BY DOES NOT HAVE TO SORT
+    def select_data_in_index_order(self, table_name, index, ascending=True, condition=None):
+        return list(self.scan_in_index_order(table_name, index, ascending, condition))
+
+    # STREAM A TABLE IN THE ORDER OF A SORTED INDEX; CHUNK FILES ARE ONLY READ WHEN THE ORDER REACHES THEM
+    def scan_in_index_order(self, table_name, index, ascending=True, condition=None):
+        data_dir = self.tables[table_name.lower()]["data_dir"]
+        loaded_chunks = {}
+        matches = self.compile_condition(table_name, *condition) if condition is not None else None
+
+        def indexed_rows():
+            for file_name, offset in index.iter_ordered(ascending):
+                if file_name not in loaded_chunks:
+                    loaded_chunks[file_name] = self.read_chunk(os.path.join(data_dir, file_name))
+                record = loaded_chunks[file_name][offset]
+                if matches is None or matches(record):
+                    yield record
+
+        # Records still in the insert log are not indexed yet: sort them and merge them in
+        log_rows = [record for record in self.read_insert_log(table_name)
+                    if matches is None or matches(record)]
+        if not log_rows:
+            yield from indexed_rows()
+            return
+        sort_columns = [(index.column, ascending)]
+        yield from heapq.merge(indexed_rows(), sort_rows(log_rows, sort_columns), key=make_sort_key(sort_columns))
+
+    # THE SOURCE OF A QUERY PIPELINE: STREAM THE RECORDS OF A TABLE (CHUNKS, THEN THE INSERT LOG) THAT MATCH
+    # AN OPTIONAL (col_name, operator, value) CONDITION, READING ONLY THE CHUNKS THAT CAN HOLD A MATCH
+    def scan_table(self, table_name, condition=None, columns=None):
+        if self.parallel_workers:
+            yield from self.parallel_scan(table_name, condition, columns, projection=columns)
+            return
+        rows = scan_rows(chunk_data for _, chunk_data in self.iter_chunks(table_name, condition, columns))
+        if condition is not None:
+            rows = filter_rows(rows, self.compile_condition(table_name, *condition))
+        yield from rows
+
+    # ESTIMATED NUMBER OF RECORDS OF A TABLE, FROM ITS ZONE MAPS
+    def table_row_count(self, table_name):
+        table_info = self.tables[table_name]
+        chunk_stats = self.table_chunk_stats(table_name)
+        return self.insert_log_rows(table_name) + sum(
+            chunk_stats[file_name]["count"] if file_name in chunk_stats else self.max_records_per_chunk
+            for file_name in self.get_chunk_files(table_info["data_dir"]))
+
+    # ESTIMATED NUMBER OF DISTINCT VALUES OF A COLUMN: FROM AN INDEX ON IT, FROM ANALYZE, OR FROM A SAMPLE
+    def column_distinct_count(self, table_name, col_name):
+        table_info = self.tables[table_name]
+        for index in self.table_indexes(table_name).values():
+            if index.column == col_name:
+                return index.distinct_count()
+        if col_name in table_info.get("distinct_counts", {}):
+            return table_info["distinct_counts"][col_name]
+
+        files = self.get_chunk_files(table_info["data_dir"])
+        sample = self.read_chunk(os.path.join(table_info["data_dir"], files[0])) if files else []
+        if not sample:
+            return 1
+        sample_distinct = len({str(record.get(col_name)) for record in sample})
+        # a key that repeats little in the sample is taken to keep growing with the table, one that
+        # repeats a lot (a category) to have been seen whole
+        if sample_distinct * 10 >= len(sample):
+            return max(sample_distinct, sample_distinct * self.table_row_count(table_name) // len(sample))
+        return sample_distinct
+
+    # JOIN SEVERAL TABLES ON (table1, column1, table2, column2) EQUALITIES, IN THE CHEAPEST ORDER
+    # With a limit the pipeline stops once offset + limit joined rows came out
+    def multi_join(self, tables, conditions, predicates=None, projection=None, limit=None, offset=0):
+        tables = [table.lower() for table in tables]
+        conditions = [(t1.lower(), c1, t2.lower(), c2) for t1, c1, t2, c2 in conditions]
+        for table in tables:
+            if table not in self.tables:
+                return f"Table {table} does not exist."
+        for t1, c1, t2, c2 in conditions:
+            for table, col in ((t1, c1), (t2, c2)):
+                if table not in tables:
+                    return f"Table {table} is not part of the join."
+                if col not in self.tables[table]["columns"]:
+                    return f"Column {col} does not exist in table {table}."
+        if len(set(tables)) != len(tables):
+            return "A table can only appear once in a join."
+
+        row_counts = {table: self.table_row_count(table) for table in tables}
+        distinct_counts = {}
+        for t1, c1, t2, c2 in conditions:
+            distinct_counts[(t1, c1)] = self.column_distinct_count(t1, c1)
+            distinct_counts[(t2, c2)] = self.column_distinct_count(t2, c2)
+        _, steps = choose_join_order(tables, conditions, row_counts, distinct_counts)
+        if steps is None:
+            return "The join conditions do not connect all the tables."
+        self.last_join_order = steps
+
+        # An inner join can apply every WHERE condition to its table before the join
+        columns = self.join_columns(tables, [(t, c) for t1, c1, t2, c2 in conditions for t, c in ((t1, c1), (t2, c2))],
+                                    [], projection)
+        sources = {table: self.join_source(table, predicates or [], columns[table]) for table in tables}
+        rows = self.project_joined_rows(self.multi_join_rows(steps, sources, self.join_column_key), projection, tables)
+        return list(limit_rows(rows, limit, offset) if limit is not None else rows)
+
+    # RUN A JOIN ORDER AS A PIPELINE: EACH TABLE IS HASHED IN TURN AND THE ROWS JOINED SO FAR STREAM THROUGH IT
+    # sources maps each table to the rows it contributes, key names the columns in the joined rows (see join_column_key)
+    def multi_join_rows(self, steps, sources, key):
+        rows = sources[steps[0][0]]
+        for table, linking in steps[1:]:
+            joined_table, joined_col, _, col = linking[0]
+            rows = grace_hash_join(sources[table], rows, key(table, col), key(joined_table, joined_col), build_is_left=False,
+                                   max_build_rows=self.join_memory_rows)
+            # A table linked to the joined ones by more than one condition checks the others on the joined rows
+            for other_table, other_joined_col, _, other_col in linking[1:]:
+                a, b = key(other_table, other_joined_col), key(table, other_col)
+                rows = filter_rows(rows, lambda row, a=a, b=b: index_key(row.get(a)) == index_key(row.get(b)))
+        return rows
+
+    # STREAM A CLUSTERED TABLE IN SORT KEY ORDER: ITS CHUNKS ARE SORTED ONE AFTER THE OTHER, THE INSERT LOG
+    # IS SORTED AND MERGED IN
+    def scan_clustered(self, table_name):
+        data_dir = self.tables[table_name]["data_dir"]
+        sort_columns = [(self.tables[table_name]["sort_key"], True)]
+        chunk_rows = scan_rows(self.read_chunk(os.path.join(data_dir, file_name))
+                               for file_name in self.get_chunk_files(data_dir))
+        log_rows = self.read_insert_log(table_name)
+        if not log_rows:
+            return chunk_rows
+        return heapq.merge(chunk_rows, sort_rows(log_rows, sort_columns), key=make_sort_key(sort_columns))
+
+    # REWRITE A TABLE GLOBALLY SORTED ON ONE COLUMN, SO IT CAN BE MERGE JOINED ON IT
+    def cluster_table(self, table_name, col_name):
+        lowercase_table_name = table_name.lower()
+        if lowercase_table_name not in self.tables:
+            return f"Table {table_name} does not exist."
+        table_info = self.tables[lowercase_table_name]
+        if col_name not in table_info["columns"]:
+            return f"Column {col_name} does not exist in table {table_name}."
+
+        self.flush_insert_log(lowercase_table_name)
+        data_dir = table_info["data_dir"]
+        # sort_rows reads the whole table (spilling sorted runs if needed) before the first row comes out
+        sorted_rows = sort_rows(self.scan_table(lowercase_table_name), [(col_name, True)],
+                                max_rows_in_memory=self.sort_memory_rows)
+        table_info["chunk_stats"] = {}
+        for index in self.table_indexes(lowercase_table_name).values():
+            index.clear()
+
+        chunk_data = []
+        chunk_count = 0
+        for record in sorted_rows:
+            chunk_data.append(record)
+            if len(chunk_data) >= self.max_records_per_chunk:
+                self.write_chunk(lowercase_table_name, self.chunk_file_name(lowercase_table_name, chunk_count), chunk_data)
+                chunk_data = []
+                chunk_count += 1
+        if chunk_data:
+            self.write_chunk(lowercase_table_name, self.chunk_file_name(lowercase_table_name, chunk_count), chunk_data)
+            chunk_count += 1
+        for file_name in self.get_chunk_files(data_dir)[chunk_count:]:
+            os.remove(os.path.join(data_dir, file_name))
+            self.forget_chunk(os.path.join(data_dir, file_name))
+
+        table_info["sort_key"] = col_name
+        self.save_metadata(lowercase_table_name)
+        self.bump_table_version(lowercase_table_name)
+        return f"Table {table_name} clustered on {col_name} ({chunk_count} chunks)."
+
+    def table_size(self, table_name):
+        data_dir = self.tables[table_name.lower()]["data_dir"]
+        files = self.get_chunk_files(data_dir)
+        if os.path.exists(os.path.join(data_dir, INSERT_LOG_FILE)):
+            files.append(INSERT_LOG_FILE)
+        return sum(os.path.getsize(os.path.join(data_dir, f)) for f in files)
+
+    # SHUT DOWN THE PROCESS POOL OF THE PARALLEL SCANS, IF ONE WAS STARTED
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    # A CONDITION AS THE PLAIN (col_name, col_type, operator, value) TUPLE THE parallel_scan WORKERS COMPILE
+    def condition_spec(self, table_name, condition):
+        if condition is None:
+            return None
+        col_name, operator, value = condition
+        return (col_name, self.tables[table_name.lower()]["types"].get(col_name), operator, value)
+
+    # RUN A parallel_scan WORKER OVER THE PLANNED CHUNKS OF A TABLE ON THE PROCESS POOL. THE CONDITION
+    # TRAVELS AS PLAIN VALUES AND IS COMPILED BY THE WORKERS; RESULTS COME BACK IN CHUNK ORDER.
+    # THE INSERT LOG IS NOT INCLUDED: CALLERS HANDLE ITS FEW ROWS THEMSELVES
+    def parallel_chunk_results(self, table_name, worker, condition=None, columns=None, **task_args):
+        table_info = self.tables[table_name.lower()]
+        if columns is not None and condition is not None and condition[0] not in columns:
+            columns = list(columns) + [condition[0]]
+        condition_spec = self.condition_spec(table_name, condition)
+        chunk_files = [(os.path.join(table_info["data_dir"], file_name), offsets)
+                       for file_name, offsets in self.plan_chunks(table_name, condition)]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.parallel_workers)
+        futures = [self.executor.submit(worker, batch, columns, condition_spec, **task_args)
+                   for batch in batches(chunk_files, self.chunks_per_task)]
+        for future in futures:
+            yield future.result()
+
+    # FILTERED AND PROJECTED RECORDS OF A TABLE, SCANNED IN PARALLEL
+    def parallel_scan(self, table_name, condition=None, columns=None, projection=None):
+        data = []
+        for rows in self.parallel_chunk_results(table_name, scan_chunk_files, condition, columns, projection=projection):
+            data.extend(rows)
+        data.extend(filter_chunk_rows(self.read_insert_log(table_name), self.condition_spec(table_name, condition), projection))
+        return data
+
+    # FEED THE RECORDS OF A TABLE INTO A HashAggregate: SERIALLY, OR PRE-AGGREGATED PER BATCH OF
+    # CHUNKS BY THE WORKERS AND MERGED HERE
+    def run_aggregate(self, table_name, group_columns, aggregates):
+        table_info = self.tables[table_name.lower()]
+        numeric_columns = [col for col, col_type in table_info["types"].items() if col_type in NUMERIC_TYPES]
+        aggregate = HashAggregate(group_columns, aggregates, max_groups=self.aggregate_memory_groups,
+                                  numeric_columns=numeric_columns)
+
+        # Decode only the needed columns; no group keeps its rows
+        needed_columns = list(group_columns or []) + [col for _, col in aggregates if col]
+        if self.parallel_workers:
+            for partial_states in self.parallel_chunk_results(table_name, aggregate_chunk_files, columns=needed_columns or None,
+                                                              group_columns=group_columns, aggregates=aggregates,
+                                                              numeric_columns=numeric_columns):
+                aggregate.add_partial(partial_states)
+            aggregate.add(self.read_insert_log(table_name))
+        else:
+            aggregate.add(self.scan_table(table_name, columns=needed_columns or None))
+        return aggregate
+
+    def select_data(self, table_name):
+        lowercase_table_name = table_name.lower()
+
+        # table existance
+        if lowercase_table_name not in self.tables:
+            print(f"Table '{table_name}' does not exist.")
+            return []
+
+        # go over all chunks and the pending insert log
+        return list(self.scan_table(lowercase_table_name))
     
     # FETCH ALL RECORDS FROM THE SPECIFIED TABLE WITH THE CONDITION
     def select_data_with_condition(self, table_name, col_name, operator, value):
@@ -151,22 +762,8 @@ class Database:
             print(f"Table '{table_name}' does not exist.")
             return []
 
-        table_info = self.tables[lowercase_table_name]
-        data_dir = table_info["data_dir"]
-        filtered_data = []
-
-        # Iterate through chunk files
-        for file_name in sorted(os.listdir(data_dir)):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-                    # Apply condition filtering
-                    for record in chunk_data:
-                        if self.apply_condition(record, col_name, operator, value):
-                            filtered_data.append(record)
-
-        return filtered_data
+        # Scan the chunk files and the pending insert log, skipping chunks ruled out by their zone maps
+        return list(self.scan_table(lowercase_table_name, (col_name, operator, value)))
 
     def select_specific_data_with_condition(self, table_name, col_to_find, col_name, operator, value):
         lowercase_table_name = table_name.lower()
@@ -184,25 +781,9 @@ class Database:
             print(f"Column '{col_name}' not found in some records.")
             return []
 
-        table_info = self.tables[lowercase_table_name]
-        data_dir = table_info["data_dir"]
-        filtered_data = []
-
-        # Iterate through chunk files
-        for file_name in sorted(os.listdir(data_dir)):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-                    # Apply condition filtering
-                    for record in chunk_data:
-                        result = None
-                        if self.apply_condition(record, col_name, operator, value):
-                            result = {col_to_find: record[col_to_find]}
-                        if result is not None:
-                            filtered_data.append(result)
-
-        return filtered_data
+        # Scan the chunk files and the pending insert log, skipping chunks ruled out by their zone maps
+        matches = self.scan_table(lowercase_table_name, (col_name, operator, value), [col_to_find])
+        return list(project_rows(matches, [col_to_find]))
     
     # DELETE ALL RECORDS FROM THE SPECIFIED TABLE
     def delete_all_records(self, table_name):
@@ -211,15 +792,25 @@ class Database:
         # Check if the table exists
         if lowercase_table_name not in self.tables:
             return f'Table {table_name} does not exist.'
+        if lowercase_table_name in self.views:
+            return f'{table_name} is a materialized view and changes only with its source table.'
 
         # Directory path where the table's chunk files are stored
         data_dir = self.tables[lowercase_table_name]["data_dir"]
 
-        # Iterate and delete each chunk file in the table's directory
+        # Iterate and delete each chunk file in the table's directory, and the insert log
         for file_name in os.listdir(data_dir):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
+            if file_name in self.get_chunk_files(data_dir) or file_name == INSERT_LOG_FILE:
                 file_path = os.path.join(data_dir, file_name)
                 os.remove(file_path)
+                self.forget_chunk(file_path)
+        self.tables[lowercase_table_name]["log_rows"] = 0
+        self.tables[lowercase_table_name]["chunk_stats"] = {}
+        for index in self.table_indexes(lowercase_table_name).values():
+            index.clear()
+        self.save_metadata(lowercase_table_name)
+        self.bump_table_version(lowercase_table_name)
+        self.refresh_views(lowercase_table_name)
 
         return f'All records deleted from {table_name}.'
 
@@ -230,74 +821,162 @@ class Database:
         # Check if the table exists
         if lowercase_table_name not in self.tables:
             return f'Table {table_name} does not exist.'
+        if lowercase_table_name in self.views:
+            return f'{table_name} is a materialized view and changes only with its source table.'
+        operator = self.normalize_operator(operator)
+        if operator is None or operator == 'between':
+            return f"Invalid operator. Use one of: {', '.join(CONDITION_OPERATORS[:-1])}"
 
         data_dir = self.tables[lowercase_table_name]["data_dir"]
 
-        # Iterate through each chunk file
-        for file_name in os.listdir(data_dir):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-
-                # Apply condition and filter data
-                new_chunk_data = [record for record in chunk_data if not self.apply_condition(record, col_name, operator, value)]
-                # Rewrite the chunk file without the deleted records
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    json.dump(new_chunk_data, file, indent=4)
+        # Pending inserts have to be in the chunks before they can be deleted
+        self.flush_insert_log(lowercase_table_name)
+        matches = self.compile_condition(lowercase_table_name, col_name, operator, value)
+
+        # Iterate through each chunk file the index or zone maps allow a match in
+        deleted_records = []
+        for file_name, _ in self.plan_chunks(lowercase_table_name, (col_name, operator, value)):
+            file_path = os.path.join(data_dir, file_name)
+            chunk_data = self.read_chunk(file_path)
+
+            # Apply condition and filter data
+            new_chunk_data = [record for record in chunk_data if not matches(record)]
+            # Rewrite the chunk file without the deleted records
+            if len(new_chunk_data) != len(chunk_data):
+                deleted_records.extend(record for record in chunk_data if matches(record))
+                self.write_chunk(lowercase_table_name, file_name, new_chunk_data)
+        self.save_metadata(lowercase_table_name)
+        self.bump_table_version(lowercase_table_name)
+        if deleted_records:
+            self.maintain_views(lowercase_table_name, removed=deleted_records)
 
         return f'Records deleted from {table_name} based on the condition.'
 
-    def join_tables(self, table1_name, table2_name, join_column1, join_column2, join_type='inner'):
+    # With a limit the join stops reading its probe side once offset + limit rows came out
+    def join_tables(self, table1_name, table2_name, join_column1, join_column2, join_type='inner', predicates=None,
+                    projection=None, limit=None, offset=0):
+        table1_name, table2_name = table1_name.lower(), table2_name.lower()
         if table1_name not in self.tables or table2_name not in self.tables:
             return 'One or both tables do not exist.'
 
-        table1_data_dir = self.tables[table1_name]["data_dir"]
-        table2_data_dir = self.tables[table2_name]["data_dir"]
-        joined_data = []
-
-        # Process each chunk file of table1
-        for file1_name in os.listdir(table1_data_dir):
-            if file1_name.startswith('chunk_') and file1_name.endswith('.json'):
-                file1_path = os.path.join(table1_data_dir, file1_name)
-                with open(file1_path, 'r', encoding='utf-8') as file1:
-                    table1_chunk_data = json.load(file1)
-
-                # Process each chunk file of table2 for each chunk of table1
-                for file2_name in os.listdir(table2_data_dir):
-                    if file2_name.startswith('chunk_') and file2_name.endswith('.json'):
-                        file2_path = os.path.join(table2_data_dir, file2_name)
-                        with open(file2_path, 'r', encoding='utf-8') as file2:
-                            table2_chunk_data = json.load(file2)
-
-                            for row1 in table1_chunk_data:
-                                for row2 in table2_chunk_data:
-                                    if row1.get(join_column1) == row2.get(join_column2):
-                                        combined_row = {**row1, **row2}
-                                        joined_data.append(combined_row)
-
-                # Add unmatched rows for left, right, and full joins
-                if join_type != 'inner':
-                    for row1 in table1_chunk_data:
-                        if join_type == 'left' and not any(row1.get(join_column1) == row2.get(join_column2) for row2 in table2_chunk_data):
-                            joined_data.append(row1)
-                        if join_type == 'full' and not any(row1.get(join_column1) == row2.get(join_column2) for row2 in table2_chunk_data):
-                            joined_data.append(row1)
-
-        if join_type in ['right', 'full']:
-            for file2_name in os.listdir(table2_data_dir):
-                if file2_name.startswith('chunk_') and file2_name.endswith('.json'):
-                    file2_path = os.path.join(table2_data_dir, file2_name)
-                    with open(file2_path, 'r', encoding='utf-8') as file2:
-                        table2_chunk_data = json.load(file2)
-
-                        for row2 in table2_chunk_data:
-                            if join_type == 'right' and not any(row2.get(join_column2) == row1.get(join_column1) for row1 in table1_chunk_data):
-                                joined_data.append(row2)
-                            if join_type == 'full' and not any(row2.get(join_column2) == row1.get(join_column1) for row1 in table1_chunk_data):
-                                joined_data.append(row2)
-
-        return joined_data
+        def run(merge):
+            rows = self.join_rows(table1_name, table2_name, join_column1, join_column2, join_type, merge=merge,
+                                  predicates=predicates, projection=projection)
+            return list(limit_rows(rows, limit, offset) if limit is not None else rows)
+        try:
+            return run(merge=True)
+        except UnsortedInput:
+            # the files were changed behind the metadata's back; the hash join does not need any order
+            return run(merge=False)
+
+    # STREAM THE ROWS OF A JOIN OF TWO EXISTING TABLES
+    # predicates is a list of (table, condition) WHERE conditions, projection a list of (name, table, column);
+    # see join_source for how they are pushed down to the scans
+    def join_rows(self, table1_name, table2_name, join_column1, join_column2, join_type='inner', merge=True,
+                  predicates=None, projection=None):
+        # Outer sides keep their unmatched rows, padded with nulls for the other table's columns
+        keep_unmatched_left = join_type in ('left', 'full')
+        keep_unmatched_right = join_type in ('right', 'full')
+        key = self.join_column_key
+
+        # WHERE conditions on a table filter its rows before the join, except on a table that gets null padded
+        # rows: those have to see the padding, so they filter the joined rows
+        late_predicates = [(table, condition) for table, condition in predicates or []
+                           if (table == table1_name and keep_unmatched_right) or (table == table2_name and keep_unmatched_left)]
+        early_predicates = [(table, condition) for table, condition in predicates or [] if (table, condition) not in late_predicates]
+        columns = self.join_columns([table1_name, table2_name], [(table1_name, join_column1), (table2_name, join_column2)],
+                                    late_predicates, projection)
+        null_left = {key(table1_name, col): None for col in columns[table1_name] or self.tables[table1_name]["columns"]}
+        null_right = {key(table2_name, col): None for col in columns[table2_name] or self.tables[table2_name]["columns"]}
+
+        # Tables clustered on their join columns are merged in one pass instead of hashing either side
+        if (merge and self.tables[table1_name].get("sort_key") == join_column1
+                and self.tables[table2_name].get("sort_key") == join_column2):
+            rows = merge_join(self.join_source(table1_name, early_predicates, columns[table1_name], clustered=True),
+                              self.join_source(table2_name, early_predicates, columns[table2_name], clustered=True),
+                              key(table1_name, join_column1), key(table2_name, join_column2),
+                              pad_unmatched_left=null_right if keep_unmatched_left else None,
+                              pad_unmatched_right=null_left if keep_unmatched_right else None)
+        else:
+            # Build the hash table on the smaller table and stream the larger one through it
+            build_left = self.table_size(table1_name) < self.table_size(table2_name)
+            if build_left:
+                build_table, build_column, probe_table, probe_column = table1_name, join_column1, table2_name, join_column2
+            else:
+                build_table, build_column, probe_table, probe_column = table2_name, join_column2, table1_name, join_column1
+            keep_unmatched_build = keep_unmatched_left if build_left else keep_unmatched_right
+            keep_unmatched_probe = keep_unmatched_right if build_left else keep_unmatched_left
+
+            # scan -> join: the probe table streams through the hash table built on the other one; a build
+            # table of more than join_memory_rows rows is partitioned to disk together with the probe table
+            rows = grace_hash_join(self.join_source(build_table, early_predicates, columns[build_table]),
+                                   self.join_source(probe_table, early_predicates, columns[probe_table]),
+                                   key(build_table, build_column), key(probe_table, probe_column),
+                                   build_is_left=build_left,
+                                   pad_unmatched_probe=(null_left if build_left else null_right) if keep_unmatched_probe else None,
+                                   pad_unmatched_build=(null_right if build_left else null_left) if keep_unmatched_build else None,
+                                   max_build_rows=self.join_memory_rows)
+
+        for table, condition in late_predicates:
+            rows = filter_rows(rows, self.joined_row_filter(table, condition, key))
+        yield from self.project_joined_rows(rows, projection, [table1_name, table2_name])
+
+    # HOW A COLUMN OF A JOINED TABLE IS NAMED IN THE ROWS INSIDE A JOIN: AS <table>.<column>, SO THAT EQUAL
+    # COLUMN NAMES OF DIFFERENT TABLES DO NOT COLLIDE; project_joined_rows NAMES THE OUTPUT COLUMNS
+    def join_column_key(self, table_name, col_name):
+        return f"{table_name}.{col_name}"
+
+    # THE COLUMNS EACH TABLE OF A JOIN HAS TO CARRY (None FOR ALL): THE PROJECTED ONES, THE JOIN COLUMNS AND
+    # THE COLUMNS OF THE CONDITIONS CHECKED AFTER THE JOIN
+    def join_columns(self, tables, join_columns, late_predicates, projection):
+        if projection is None:
+            return {table: None for table in tables}
+        columns = {table: [] for table in tables}
+        needed = [(table, col) for _, table, col in projection] + list(join_columns)
+        needed += [(table, condition[0]) for table, condition in late_predicates]
+        for table, col in needed:
+            if col not in columns[table]:
+                columns[table].append(col)
+        return columns
+
+    # SCAN ONE TABLE OF A JOIN WITH ITS OWN WHERE CONDITIONS APPLIED BEFORE THE JOIN (THE FIRST ONE PLANS THE CHUNKS
+    # TO READ LIKE ANY SCAN), KEEPING ONLY THE GIVEN COLUMNS
+    def join_source(self, table_name, predicates, columns=None, clustered=False):
+        conditions = [condition for table, condition in predicates if table == table_name]
+        if clustered:
+            rows = self.scan_clustered(table_name)
+        else:
+            scan_columns = None
+            if columns is not None:
+                scan_columns = list(columns) + [condition[0] for condition in conditions if condition[0] not in columns]
+            rows = self.scan_table(table_name, conditions[0] if conditions else None, scan_columns)
+            conditions = conditions[1:]
+        for condition in conditions:
+            rows = filter_rows(rows, self.compile_condition(table_name, *condition))
+        if columns is not None:
+            return ({f"{table_name}.{col}": row.get(col) for col in columns} for row in rows)
+        return ({f"{table_name}.{col}": value for col, value in row.items()} for row in rows)
+
+    def joined_row_filter(self, table_name, condition, key):
+        test = self.compile_value_test(table_name, *condition)
+        column = key(table_name, condition[0])
+        return lambda row: test(row.get(column))
+
+    # THE OUTPUT ROWS OF A JOIN: THE PROJECTED COLUMNS, OR THE RECORDS OF ITS TABLES MERGED IN THE ORDER THE QUERY
+    # NAMES THE TABLES. A later table's column replaces an earlier one of the same name, except with the null
+    # padding of an outer join
+    def project_joined_rows(self, rows, projection, tables):
+        if projection is not None:
+            return ({name: row.get(f"{table}.{col}") for name, table, col in projection} for row in rows)
+        columns = [(f"{table}.{col}", col) for table in tables for col in self.tables[table]["columns"]]
+
+        def merged(row):
+            record = {}
+            for key, col in columns:
+                if key in row and (col not in record or row[key] is not None):
+                    record[col] = row[key]
+            return record
+        return (merged(row) for row in rows)
 
 
     def aggregate_data(self, table_name, agg_column, agg_func):
@@ -307,95 +986,115 @@ class Database:
         if lowercase_table_name not in self.tables:
             return f"Table {table_name} does not exist."
 
-        data_dir = self.tables[lowercase_table_name]["data_dir"]
-        aggregated_result = None
-        count = 0
+        # Check if the aggregation column exists
+        if agg_column not in self.tables[lowercase_table_name]["columns"]:
+            return f"Column {agg_column} does not exist in table {table_name}."
+        if agg_func not in AGGREGATE_FUNCTIONS:
+            return f"Unsupported aggregate function {agg_func}."
 
-        # Iterate through each chunk file
-        for file_name in os.listdir(data_dir):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-
-                # Check if the aggregation column exists
-                if agg_column not in chunk_data[0]:
-                    return f"Column {agg_column} does not exist in table {table_name}."
-
-                # Process each row in the chunk
-                for row in chunk_data:
-                    col_value = self.convert_type_for_comparison(row[agg_column], row[agg_column])
-                    if agg_func == 'sum':
-                        aggregated_result = aggregated_result + col_value if aggregated_result is not None else col_value
-                    elif agg_func == 'avg':
-                        aggregated_result = aggregated_result + col_value if aggregated_result is not None else col_value
-                        count += 1
-                    elif agg_func == 'count':
-                        count += 1
-                    elif agg_func == 'min':
-                        aggregated_result = min(aggregated_result, col_value) if aggregated_result is not None else col_value
-                    elif agg_func == 'max':
-                        aggregated_result = max(aggregated_result, col_value) if aggregated_result is not None else col_value
-
-        # Final calculation for average
-        if agg_func == 'avg':
-            return aggregated_result / count if count > 0 else 'No data to calculate average.'
+        # One pass over every chunk file and the pending insert log, as a single group;
+        # count counts every row, like it always did
+        aggregates = [(agg_func, agg_column if agg_func != 'count' else None)]
+        aggregate = self.run_aggregate(lowercase_table_name, [], aggregates)
+        aggregated_result = next(aggregate.results(), {}).get(agg_func)
 
         if agg_func == 'count':
-            return count
-
-        return aggregated_result if aggregated_result is not None else 'No data found for aggregation.'
+            return aggregated_result or 0
+        if aggregated_result is None:
+            return 'No data to calculate average.' if agg_func == 'avg' else 'No data found for aggregation.'
+        return aggregated_result
             
-    def group_by(self, table_name, group_columns, agg_column, agg_func):
+    def group_by(self, table_name, group_columns, agg_column=None, agg_func=None, aggregates=None):
         lowercase_table_name = table_name.lower()
 
         # Check if the table exists
         if lowercase_table_name not in self.tables:
             return f"Table {table_name} does not exist."
 
-        data_dir = self.tables[lowercase_table_name]["data_dir"]
-        grouped_data = defaultdict(list)
-
-        # Iterate through each chunk file
-        for file_name in os.listdir(data_dir):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
-
-                    if group_columns:
-                        # Perform grouping based on specified group columns
-                        for row in chunk_data:
-                            key = tuple(row[col] for col in group_columns)
-                            grouped_data[key].append(row)
-                    else:
-                        # No group by columns, treat entire data set as a single group
-                        grouped_data[None].extend(chunk_data)
-
-        # Perform aggregation and format results
-        formatted_result = []
-        for key, group in grouped_data.items():
-            result_dict = {}
-            if group_columns:
-                result_dict.update({col: key[i] for i, col in enumerate(group_columns)})
-            
-            if agg_func and agg_column:
-                # Filter out rows where agg_column is not a number or is missing
-                filtered_data = [self.convert_to_number_if_possible(row.get(agg_column, 0)) for row in group]
-
-                if agg_func.lower() == 'count':
-                    result_dict['count'] = len(group)
-                elif agg_func.lower() == 'sum':
-                    result_dict['sum'] = sum(filtered_data)
-                elif agg_func.lower() == 'avg':
-                    result_dict['avg'] = sum(filtered_data) / len(filtered_data) if filtered_data else 0
+        # aggregates is a list of (func, column) pairs; the single agg_func/agg_column form is still accepted
+        if aggregates is None:
+            if agg_func and agg_column and agg_func.lower() != 'count':
+                aggregates = [(agg_func.lower(), agg_column)]
             else:
                 # Default to count if no aggregation function is specified
-                result_dict['count'] = len(group)
-
-            formatted_result.append(result_dict)
+                aggregates = [("count", None)]
+
+        # Stream each chunk file and the pending insert log into the per-group accumulators
+        return list(self.run_aggregate(lowercase_table_name, group_columns, aggregates).results())
+
+    def new_view(self, view_name, source, group_columns, aggregates):
+        types = self.tables[source]["types"] if source in self.tables else {}
+        numeric_columns = [col for col, col_type in types.items() if col_type in NUMERIC_TYPES]
+        return MaterializedView(source, group_columns, aggregates, numeric_columns,
+                                os.path.join(self.data_dir, view_name, VIEW_STATE_FILE))
+
+    # STORE A GROUP BY AS ITS OWN TABLE, KEPT CURRENT BY THE WRITES TO ITS SOURCE TABLE
+    def create_materialized_view(self, view_name, source, group_columns, aggregates):
+        view_name, source = view_name.lower(), source.lower()
+        if view_name in self.tables:
+            return f"Table {view_name} already exists."
+        if source not in self.tables:
+            return f"Table {source} does not exist."
+        if source in self.views:
+            return f"{source} is a materialized view; views can only be defined on tables."
+        for col in group_columns + [col for _, col in aggregates if col]:
+            if col not in self.tables[source]["columns"]:
+                return f"Column {col} does not exist in table {source}."
+
+        view = self.new_view(view_name, source, group_columns, aggregates)
+        data_dir_path = os.path.join(self.data_dir, view_name)
+        os.makedirs(data_dir_path, exist_ok=True)
+        self.views[view_name] = view
+        self.tables[view_name] = {"columns": view.columns, "data_dir": data_dir_path, "log_rows": 0,
+                                  "format": "json", "types": {}, "chunk_stats": {}, "indexes": {}}
+        self.refresh_view(view_name)
+        return f"Materialized view {view_name} created ({len(view.accumulators.groups)} groups)."
+
+    # RECOMPUTE A VIEW FROM ITS SOURCE TABLE
+    def refresh_view(self, view_name):
+        view = self.views[view_name]
+        if view.source not in self.tables:
+            return f"Table {view.source} does not exist."
+        view.reset()
+        needed_columns = view.group_columns + [col for _, col in view.aggregates if col]
+        view.add(self.scan_table(view.source, columns=needed_columns))
+        self.store_view(view_name)
+        return f"Materialized view {view_name} refreshed ({len(view.accumulators.groups)} groups)."
+
+    # WRITE THE ROWS OF A VIEW TO ITS CHUNK FILES, WITH THE ACCUMULATORS THEY ARE COMPUTED FROM
+    def store_view(self, view_name):
+        table_info = self.tables[view_name]
+        rows = list(self.views[view_name].rows())
+        chunk_count = 0
+        for start in range(0, len(rows), self.max_records_per_chunk):
+            self.write_chunk(view_name, self.chunk_file_name(view_name, chunk_count), rows[start:start + self.max_records_per_chunk])
+            chunk_count += 1
+        for file_name in self.get_chunk_files(table_info["data_dir"])[chunk_count:]:
+            os.remove(os.path.join(table_info["data_dir"], file_name))
+            self.forget_chunk(os.path.join(table_info["data_dir"], file_name))
+            self.table_chunk_stats(view_name).pop(file_name, None)
+        self.views[view_name].save_state()
+        self.save_metadata(view_name)
+        self.bump_table_version(view_name)
+
+    # APPLY THE ROWS A WRITE ADDED TO AND REMOVED FROM A TABLE TO THE VIEWS DEFINED ON IT
+    def maintain_views(self, table_name, added=(), removed=()):
+        for view_name, view in self.views.items():
+            if view.source != table_name:
+                continue
+            if view.remove(removed):
+                view.add(added)
+                self.store_view(view_name)
+            else:
+                # a deleted row held a group's min or max
+                self.refresh_view(view_name)
 
-        return formatted_result
+    # REBUILD THE VIEWS OF A TABLE WHOSE CONTENTS OR COLUMN TYPES WERE REPLACED
+    def refresh_views(self, table_name):
+        for view_name, view in list(self.views.items()):
+            if view.source == table_name:
+                self.views[view_name] = self.new_view(view_name, view.source, view.group_columns, view.aggregates)
+                self.refresh_view(view_name)
 
 
     def aggregate_data_internal(self, data, agg_column, agg_func):
@@ -420,7 +1119,7 @@ class Database:
         except Exception as e:
             return f'Aggregation error: {str(e)}'
     
-    def order_by(self, data, sort_columns):
+    def order_by(self, data, sort_columns, limit=None):
         # Return an empty list if no data is provided
         if not data:
             return []
@@ -429,51 +1128,58 @@ class Database:
         if not all(col in data[0] for col, _ in sort_columns):
             return f"Some columns specified for sorting do not exist in the data."
 
-        # Get the length of the data
-        n = len(data)
+        # Sorts in memory when the rows fit, otherwise spills sorted runs and merges them;
+        # with a limit only the top rows are kept in a bounded heap
+        return list(sort_rows(data, sort_columns, limit=limit, max_rows_in_memory=self.sort_memory_rows))
 
-        # Implementing bubble sort
-        for i in range(n):
-            for j in range(0, n-i-1):
-                # Swap rows based on the columns and order specified in sort_columns
-                if self.should_swap(data[j], data[j+1], sort_columns):
-                    data[j], data[j+1] = data[j+1], data[j]
-
-        # Return the sorted data
-        return data
-
-    def should_swap(self, row1, row2, sort_columns):
-        # Compare rows based on each sorting column
-        for col, ascending in sort_columns:
-            if row1[col] != row2[col]:
-                # Determine swap based on ascending or descending order
-                return row1[col] > row2[col] if ascending else row1[col] < row2[col]
-        return False
-    
     def update_records_with_condition(self, table_name, set_col_name, set_value, condition_col_name, condition_value):
         lowercase_table_name = table_name.lower()
 
         # Check if the table exists
         if lowercase_table_name not in self.tables:
             return f"Table {table_name} does not exist."
+        if lowercase_table_name in self.views:
+            return f"{table_name} is a materialized view and changes only with its source table."
 
         data_dir = self.tables[lowercase_table_name]["data_dir"]
 
-        # Iterate through each chunk file
-        for file_name in os.listdir(data_dir):
-            if file_name.startswith('chunk_') and file_name.endswith('.json'):
-                file_path = os.path.join(data_dir, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    chunk_data = json.load(file)
+        # Pending inserts have to be in the chunks before they can be updated
+        self.flush_insert_log(lowercase_table_name)
 
-                # Update records if condition is met
-                for record in chunk_data:
-                    if record.get(condition_col_name) == condition_value:
-                        record[set_col_name] = set_value
-
-                # Save the updated chunk back to the file
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    json.dump(chunk_data, file, indent=4)
+        # Typed columns store typed values; the condition is compiled once like the other scans
+        types = self.tables[lowercase_table_name]["types"]
+        try:
+            set_value = cast_value(types.get(set_col_name), set_value)
+            matches = self.compile_condition(lowercase_table_name, condition_col_name, '==', condition_value)
+        except ValueError as e:
+            return f"Invalid value type: {e}"
+
+        # Iterate through each chunk file the index or zone maps allow a match in
+        old_records, new_records = [], []
+        for file_name, _ in self.plan_chunks(lowercase_table_name, (condition_col_name, '==', condition_value)):
+            file_path = os.path.join(data_dir, file_name)
+            chunk_data = self.read_chunk(file_path, cached=False)
+
+            # Update records if condition is met
+            updated = False
+            for record in chunk_data:
+                if matches(record):
+                    old_records.append(dict(record))
+                    record[set_col_name] = set_value
+                    new_records.append(record)
+                    updated = True
+
+            # Save the updated chunk back to the file
+            if updated:
+                self.write_chunk(lowercase_table_name, file_name, chunk_data)
+
+        # Changing the sort key of records in place breaks the clustering
+        if new_records and set_col_name == self.tables[lowercase_table_name].get("sort_key"):
+            self.tables[lowercase_table_name]["sort_key"] = None
+        self.save_metadata(lowercase_table_name)
+        self.bump_table_version(lowercase_table_name)
+        if new_records:
+            self.maintain_views(lowercase_table_name, added=new_records, removed=old_records)
 
         return f"Records updated in {table_name} based on the condition."
     
@@ -486,20 +1192,57 @@ class Database:
     #     self.save_to_file(table_name)  # Reuse save_to_file for updating
 
     def load_existing_tables(self):
+        # Tables come from the catalog, without reading any file of their own. A table directory the catalog
+        # does not know yet is read from its metadata.json once and added (create_tables_from_csv.py records
+        # the tables it writes itself)
+        catalog_changed = False
         for table_name in os.listdir(self.data_dir):
             table_dir_path = os.path.join(self.data_dir, table_name)
             if os.path.isdir(table_dir_path):
-                metadata_file_path = os.path.join(table_dir_path, "metadata.json")
-                if os.path.exists(metadata_file_path):
+                metadata = self.catalog.get(table_name)
+                if metadata is None:
+                    metadata_file_path = os.path.join(table_dir_path, "metadata.json")
+                    if not os.path.exists(metadata_file_path):
+                        print(f"Metadata file not found for table '{table_name}'.")
+                        continue
                     with open(metadata_file_path, "r", encoding='utf-8') as file:
                         metadata = json.load(file)
-                        self.tables[table_name] = {
-                            "columns": metadata["columns"],
-                            "data_dir": table_dir_path
-                        }
-                else:
-                    print(f"Metadata file not found for table '{table_name}'.")
+                    self.catalog.set(table_name, {key: value for key, value in metadata.items() if key != "chunk_stats"})
+                    catalog_changed = True
+                self.open_table(table_name, table_dir_path, metadata)
 
+        # Tables whose directory is gone leave the catalog
+        for table_name in list(self.catalog.entries):
+            if table_name not in self.tables:
+                self.catalog.remove(table_name)
+                catalog_changed = True
+        if catalog_changed or not self.catalog.exists:
+            self.catalog.save()
+
+        # Views are loaded once every table is known, as their accumulators depend on the source's column types
+        for view_name, definition in list(self.views.items()):
+            view = self.new_view(view_name, definition["source"], definition["group_columns"], definition["aggregates"])
+            view.load_state()
+            self.views[view_name] = view
+
+    # SET UP self.tables FOR A TABLE FROM ITS METADATA
+    def open_table(self, table_name, table_dir_path, metadata):
+        self.tables[table_name] = {
+            "columns": metadata["columns"],
+            "data_dir": table_dir_path,
+            "format": metadata.get("format", "json"),
+            "types": metadata.get("types", {}),
+            "sort_key": metadata.get("sort_key"),
+            "distinct_counts": metadata.get("distinct_counts", {}),
+            # The zone maps, the indexes and the number of records in the insert log are loaded on first use
+            # (table_chunk_stats, table_indexes, insert_log_rows)
+            "chunk_stats": metadata.get("chunk_stats"),
+            "index_definitions": metadata.get("indexes", {}),
+            "indexes": None,
+            "log_rows": None
+        }
+        if "view" in metadata:
+            self.views[table_name] = metadata["view"]
 
     # def load_from_file(self, table_name):
     #     filename = f'{table_name}.csv'
@@ -513,7 +1256,52 @@ class Database:
     #         print(f"Error loading data from {filename}.")
 
 
-    def execute_query(self, query):
+    def bump_table_version(self, table_name):
+        self.table_versions[table_name] = self.table_versions.get(table_name, 0) + 1
+
+    # THE TABLES A READ-ONLY QUERY READS, OR None FOR QUERIES WHOSE RESULTS ARE NOT CACHED
+    def query_tables(self, query):
+        tokens = query.lower().split()
+        if len(tokens) >= 3 and tokens[0] == 'join':
+            end = tokens.index('on') if 'on' in tokens else 3
+            return ' '.join(tokens[1:end]).replace(',', ' ').split()
+        if tokens and tokens[0] in ('find', 'select'):
+            if tokens[:2] == ['find', 'all'] and len(tokens) >= 3:
+                return [tokens[2]]
+            if 'from' in tokens[:-1]:
+                return [tokens[tokens.index('from') + 1]]
+        return None
+
+    # RUN A QUERY; READS ARE ANSWERED FROM THE RESULT CACHE WHILE NONE OF THEIR TABLES WAS WRITTEN
+    # A query prefixed with "nocache", or use_cache=False, always runs and leaves the cache alone
+    def execute_query(self, query, use_cache=True):
+        if query.lower().startswith('nocache '):
+            query, use_cache = query[len('nocache '):].lstrip(), False
+        tables = self.query_tables(query) if use_cache and self.result_cache is not None else None
+        if not tables:
+            return self.copy_rows(self.run_query(query))
+
+        key = ResultCache.normalize(query)
+        versions = tuple(self.table_versions.get(table, 0) for table in tables)
+        result = self.result_cache.get(key, versions)
+        if result is not None:
+            return self.copy_rows(result)
+        result = self.copy_rows(self.run_query(query))
+        # Only results are cached, not error messages
+        if isinstance(result, list):
+            self.result_cache.put(key, versions, result)
+            return self.copy_rows(result)
+        return result
+
+    # Scanned records are shared with the chunk cache (and results with the result cache),
+    # so the caller gets its own copy of every row it can mutate
+    @staticmethod
+    def copy_rows(result):
+        if isinstance(result, list):
+            return [dict(row) if isinstance(row, dict) else row for row in result]
+        return result
+
+    def run_query(self, query):
         tokens = query.lower().split()
         table_name = None
         selected_data = None
@@ -522,6 +1310,14 @@ class Database:
         if query.strip().lower() == 'exit':
             return 'Exiting...'
 
+        # find and join queries can end with limit <n> [offset <m>]; it is taken off before the rest is parsed
+        limit, offset = None, 0
+        if query.startswith('find') or query.startswith('join'):
+            query, limit, offset = self.parse_limit(query)
+            if query is None:
+                return 'Invalid limit format. Use: ... limit <n> [offset <m>]'
+            tokens = query.lower().split()
+
         # find specific table
         if 'from' in tokens:
             from_index = tokens.index('from')
@@ -529,11 +1325,57 @@ class Database:
         elif query.startswith('create table') or query.startswith('insert into'):
             table_name = query.split()[2]
 
-        if query.startswith('create table'):
+        if query.startswith('create materialized view'):
+            # create materialized view <view_name> as select <func>(<col>), ... from <table_name> group by <col>, ...
+            match = re.match(r'create materialized view\s+(\w+)\s+as\s+select\s+(.+?)\s+from\s+(\w+)\s+group by\s+(.+?)\s*;?\s*$',
+                             query.strip(), re.IGNORECASE)
+            if not match:
+                return 'Invalid materialized view format. Use: create materialized view <view_name> as select <func>(<col>), ... from <table_name> group by <col>, ...'
+            view_name, select_list, source, group_list = match.groups()
+            aggregate_parts = [part for part in select_list.split(',') if '(' in part]
+            try:
+                aggregates = parse_aggregates(','.join(aggregate_parts)) if aggregate_parts else [("count", None)]
+            except ValueError as e:
+                return f'{e} Aggregate functions are count, sum, avg, min, max.'
+            group_columns = [col.strip() for col in group_list.split(',') if col.strip()]
+            return self.create_materialized_view(view_name, source, group_columns, aggregates)
+
+        elif query.startswith('refresh materialized view'):
+            tokens = query.split()
+            if len(tokens) != 4 or tokens[3].lower() not in self.views:
+                return 'Invalid refresh format. Use: refresh materialized view <view_name>'
+            return self.refresh_view(tokens[3].lower())
+
+        elif query.startswith('create index'):
+            # create index <index_name> on <table_name>(<col_name>) [using hash|sorted]
+            match = re.match(r'create index\s+(\w+)\s+on\s+(\w+)\s*\(\s*(\w+)\s*\)\s*(?:using\s+(\w+))?\s*$', query.strip())
+            if not match:
+                return 'Invalid create index format. Use: create index <index_name> on <table_name>(<col_name>) [using hash|sorted]'
+            index_name, table_name, col_name, index_type = match.groups()
+            return self.create_index(index_name, table_name.lower(), col_name, (index_type or 'hash').lower())
+
+        elif query.startswith('create table'):
             tokens = query.split()
             table_name = tokens[2]
-            columns = [col.strip(',()') for col in tokens[3:]]
-            result = self.create_table(table_name, columns)
+            if '(' in query and ')' in query:
+                # create table <table_name> (<col> [type], ...) or (<col> <col> ...): a second word is only a type
+                # when it names one, or when the columns are comma separated (where an unknown type is an error)
+                column_list = query[query.index('(') + 1:query.rindex(')')]
+                column_defs = []
+                for part in column_list.split(','):
+                    words = part.split()
+                    if len(words) == 2 and (words[1].lower() in COLUMN_TYPES or ',' in column_list):
+                        column_defs.append(words)
+                    else:
+                        column_defs.extend([word] for word in words)
+            else:
+                column_defs = [[col.strip(',()')] for col in tokens[3:]]
+            columns = [col_def[0] for col_def in column_defs]
+            types = {col_def[0]: col_def[1].lower() for col_def in column_defs if len(col_def) > 1}
+            unknown_types = [col_type for col_type in types.values() if col_type not in COLUMN_TYPES]
+            if unknown_types:
+                return f"Unknown column type {unknown_types[0]}. Use one of: {', '.join(COLUMN_TYPES)}."
+            result = self.create_table(table_name, columns, types=types)
             return result  # Return the result directly, which may be "Table created" or "Table already exists."
         
         elif query.startswith('insert into'):
@@ -549,28 +1391,47 @@ class Database:
         elif query.startswith('find all'):
             tokens = query.split()
             table_name = tokens[2]
-            if(len(tokens) == 3) or ('order by' in query and not 'where' in query):
-                selected_data = self.select_data(table_name)
-            elif 'where' in tokens and len(tokens) > 3:
-                # Find statement with conditions
+            condition = None
+            if 'where' in tokens and len(tokens) > 3:
+                # Find statement with conditions, optionally followed by an order by clause
                 condition_start_index = tokens.index('where')
                 condition_tokens = tokens[condition_start_index + 1:]
-
-                # Ensure the condition has a valid structure
-                if len(condition_tokens) == 3:
-                    col_name = condition_tokens[0]
-                    operator = condition_tokens[1]
-                    value = condition_tokens[2].strip('\"')
-                    try:
-                        if col_name in self.tables[table_name]['columns']:
-                            value = self.convert_type(self.tables[table_name], col_name, value)
-                    except ValueError:
-                        return 'Invalid value type.'
-
-                    selected_data = self.select_data_with_condition(table_name, col_name, operator, value)
-                    # return selected_data
-                else:
-                    return 'Invalid condition format. Use: find all <table_name> where <col_name> <operator> "<value>"'
+                if 'order' in condition_tokens:
+                    condition_tokens = condition_tokens[:condition_tokens.index('order')]
+
+                try:
+                    condition = self.parse_condition(table_name, condition_tokens)
+                except ValueError:
+                    return 'Invalid value type.'
+                if condition is None:
+                    return 'Invalid condition format. Use: find all <table_name> where <col_name> <operator> "<value>" or <col_name> between <low> and <high>'
+
+            # A single order by column with a sorted index is read in index order instead of sorted. The
+            # index of a string column keeps text order, while order by puts numeric text first
+            sort_columns = self.parse_order_by(query)
+            if len(sort_columns) == 1 and table_name in self.tables:
+                index = self.find_index(table_name, sort_columns[0][0], ("sorted",))
+                if index is not None and index.col_type != "string":
+                    rows = self.scan_in_index_order(table_name, index, sort_columns[0][1], condition)
+                    return list(limit_rows(rows, limit, offset) if limit is not None else rows)
+
+            if condition is not None or len(tokens) == 3 or 'order by' in query:
+                if table_name not in self.tables:
+                    print(f"Table '{table_name}' does not exist.")
+                    return []
+                # scan -> filter -> sort -> limit: rows stream from the chunks into the sort, which spills sorted
+                # runs past sort_memory_rows instead of holding the table. With a limit the sort only keeps
+                # the first offset + limit rows in a bounded heap, and without a sort the scan stops reading
+                # chunk files once enough rows came through
+                rows = self.scan_table(table_name, condition)
+                if sort_columns:
+                    if not all(col in self.tables[table_name]['columns'] for col, _ in sort_columns):
+                        return "Some columns specified for sorting do not exist in the data."
+                    rows = order_rows(rows, sort_columns, limit=offset + limit if limit is not None else None,
+                                      max_rows_in_memory=self.sort_memory_rows)
+                if limit is not None:
+                    rows = limit_rows(rows, limit, offset)
+                return list(rows)
 
             
         elif query.startswith('delete all'):
@@ -611,17 +1472,15 @@ class Database:
                 condition_start_index = tokens.index('where')
                 condition_tokens = tokens[condition_start_index + 1:]
 
-                if len(condition_tokens) >= 3:
-                    col_name = condition_tokens[0]
-                    operator = condition_tokens[1]
-                    value = " ".join(condition_tokens[2:]).strip('\"')
-                    try:
-                        if col_name in self.tables[table_name]['columns']:
-                            value = self.convert_type(self.tables[table_name], col_name, value)
-                    except ValueError:
-                        return 'Invalid value type.'
-
-                    selected_data = self.select_specific_data_with_condition(table_name, col_to_find, col_name, operator, value)
+                if 'order' in condition_tokens:
+                    condition_tokens = condition_tokens[:condition_tokens.index('order')]
+
+                try:
+                    condition = self.parse_condition(table_name, condition_tokens)
+                except ValueError:
+                    return 'Invalid value type.'
+                if condition is not None:
+                    selected_data = self.select_specific_data_with_condition(table_name, col_to_find, *condition)
                     # return selected_data
             else:
                 return 'Invalid condition format. Use: find <column_name> from <table_name> where <col_name> <operator> "<value>"'
@@ -659,62 +1518,192 @@ class Database:
             except IndexError:
                 return 'Error in parsing the update query.'
 
-        elif query.startswith('join'):
+        elif query.startswith('convert table'):
+            # convert table <table_name> to <json|columnar>
             tokens = query.split()
-            if len(tokens) < 6:  # Adjusted for two join columns
-                return 'Invalid join query format.'
+            if len(tokens) != 5 or tokens[3].lower() != 'to':
+                return 'Invalid convert query format. Use: convert table <table_name> to <json|columnar>'
+            return self.convert_table_format(tokens[2].lower(), tokens[4].lower())
+
+        elif query.startswith('infer types'):
+            tokens = query.split()
+            if len(tokens) != 3:
+                return 'Invalid infer query format. Use: infer types <table_name>'
+            return self.infer_table_types(tokens[2].lower())
+
+        elif query.strip() == 'cache stats':
+            lines = []
+            for name, cache in (("Chunk cache", self.chunk_cache), ("Result cache", self.result_cache)):
+                if cache is None:
+                    lines.append(f"{name} is disabled.")
+                else:
+                    lines.append(f"{name}: " + ", ".join(f"{key}: {value}" for key, value in cache.stats().items()))
+            return "\n".join(lines)
+
+        elif query.startswith('cluster table'):
+            tokens = query.split()
+            if len(tokens) != 5 or tokens[3].lower() != 'on':
+                return 'Invalid cluster query format. Use: cluster table <table_name> on <col_name>'
+            return self.cluster_table(tokens[2], tokens[4])
+
+        elif query.startswith('analyze'):
+            tokens = query.split()
+            if len(tokens) != 2:
+                return 'Invalid analyze query format. Use: analyze <table_name>'
+            return self.analyze_table(tokens[1])
 
-            table1_name = tokens[1]
-            table2_name = tokens[2]
-            join_column1 = tokens[4]  # Join column for the first table
-            join_column2 = tokens[5]  # Join column for the second table
+        elif query.startswith('join'):
+            # join <table1> <table2> on <col1> <col2> [left|right|full] [where ...] [project ...] [limit ...]
+            # join <table>, <table>, ... on <table>.<col> = <table>.<col> [and ...] [where ...] [project ...] [limit ...]
+            match = re.match(r'join\s+(.+?)\s+on\s+(.+?)(?:\s+where\s+(.+?))?(?:\s+project\s+(.+?))?\s*;?\s*$',
+                             query.strip(), re.IGNORECASE)
+            if not match:
+                return 'Invalid join query format.'
+            table_part, on_part, where_part, project_part = match.groups()
+            tables = [table.lower() for table in re.split(r'[\s,]+', table_part) if table]
+            for table in tables:
+                if table not in self.tables:
+                    return f'Table {table} does not exist.'
+            # where <table>.<col> <operator> <value> [and ...] / project <table>.<col>, ...; the table can be left
+            # out for a column only one of the tables has
+            try:
+                predicates, projection = self.parse_join_clauses(tables, where_part, project_part)
+            except ValueError as e:
+                return str(e)
+
+            if '=' in on_part:
+                conditions = []
+                for part in re.split(r'\s+and\s+|,', on_part, flags=re.IGNORECASE):
+                    condition = re.match(r'^\s*(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\s*$', part)
+                    if condition is None:
+                        return 'Invalid join format. Use: join <table>, <table>, ... on <table>.<col> = <table>.<col> and ...'
+                    conditions.append(condition.groups())
+                return self.multi_join(tables, conditions, predicates, projection, limit, offset)
+
+            on_tokens = on_part.split()
+            if len(tables) != 2 or len(on_tokens) not in (2, 3):
+                return 'Invalid join query format.'
             join_type = 'inner'  # Default join type
 
             # Handle different types of joins if specified in the query
-            if 'left' in query:
-                join_type = 'left'
-            elif 'right' in query:
-                join_type = 'right'
-            elif 'full' in query:
-                join_type = 'full'
-
-            return self.join_tables(table1_name, table2_name, join_column1, join_column2, join_type)
+            if len(on_tokens) == 3:
+                join_type = on_tokens[2].lower()
+                if join_type not in ('inner', 'left', 'right', 'full'):
+                    return 'Invalid join type. Use one of: inner, left, right, full.'
+
+            return self.join_tables(tables[0], tables[1], on_tokens[0], on_tokens[1], join_type, predicates, projection,
+                                    limit, offset)
         
         
         elif 'select' in tokens and 'group by' in query.lower():
-            select_parts = query.lower().split('select')[1].split('from')[0].strip().split(',')
-            agg_func, agg_column = None, None
-            if any(func in select_parts[0] for func in ['sum', 'avg', 'count', 'min', 'max']):
-                agg_func_part = select_parts[0].split('(')
-                agg_func = agg_func_part[0].strip()
-                agg_column = agg_func_part[1].split(')')[0].strip()
-
+            # select [<group_col>, ...] <func>(<col>|*), ... from <table_name> group by <col>, ...
             group_by_index = query.lower().find('group by')
-            group_columns = query[group_by_index + 9:].split(',')
+            group_columns = [col.strip() for col in query[group_by_index + 9:].strip(' ;').split(',') if col.strip()]
 
-            return self.group_by(table_name, group_columns, agg_column, agg_func)
+            select_list = query[query.lower().index('select') + 6:query.lower().index(' from ')]
+            aggregate_parts = [part for part in select_list.split(',') if '(' in part]
+            try:
+                aggregates = parse_aggregates(','.join(aggregate_parts)) if aggregate_parts else None
+            except ValueError as e:
+                return f'{e} Use: select <func>(<col>), ... from <table_name> group by <col>, ... with func one of count, sum, avg, min, max'
+
+            return self.group_by(table_name, group_columns, aggregates=aggregates)
         else:
             return 'Unsupported query.'
 
         # handle order by query
         if 'order by' in query.lower():
-            order_by_index = query.lower().find('order by')
-            order_by_clause = query[order_by_index + 9:].strip()
-
-            order_columns = order_by_clause.split(',')
-            sort_columns = []
-            for col in order_columns:
-                col_parts = col.strip().split()
-                column_name = col_parts[0].strip()
-                ascending = True 
-                if len(col_parts) > 1 and col_parts[1].lower() == 'desc':
-                    ascending = False
-                sort_columns.append((column_name, ascending))
-            
-            return self.order_by(selected_data, sort_columns)
-        
+            selected_data = self.order_by(selected_data, self.parse_order_by(query), offset + limit if limit is not None else None)
+
+        if limit is not None and isinstance(selected_data, list):
+            return selected_data[offset:offset + limit]
         return selected_data
 
+    # PARSE THE WHERE AND PROJECT CLAUSES OF A JOIN INTO [(table, condition)] AND [(name, table, column)]
+    def parse_join_clauses(self, tables, where_clause, project_clause):
+        def resolve(name):
+            if '.' in name:
+                table_name, col_name = name.split('.', 1)
+                table_name = table_name.lower()
+            else:
+                owners = [table for table in tables if name in self.tables[table]['columns']]
+                if len(owners) > 1:
+                    raise ValueError(f"Column {name} is ambiguous; write it as <table>.{name}.")
+                table_name, col_name = (owners[0] if owners else None), name
+            if table_name not in tables or col_name not in self.tables[table_name]['columns']:
+                raise ValueError(f"Column {name} does not exist in the joined tables.")
+            return table_name, col_name
+
+        predicates = []
+        tokens = where_clause.split() if where_clause else []
+        i = 0
+        while i < len(tokens):
+            size = 5 if i + 1 < len(tokens) and tokens[i + 1].lower() == 'between' else 3
+            condition_tokens = tokens[i:i + size]
+            if len(condition_tokens) < size or self.normalize_operator(condition_tokens[1]) is None:
+                raise ValueError('Invalid condition format. Use: where <table>.<col> <operator> <value> [and ...]')
+            table_name, col_name = resolve(condition_tokens[0])
+            try:
+                condition = self.parse_condition(table_name, [col_name, condition_tokens[1]] + condition_tokens[2:])
+            except ValueError:
+                raise ValueError('Invalid value type.')
+            predicates.append((table_name, condition))
+            i += size
+            if i < len(tokens):
+                if tokens[i].lower() != 'and':
+                    raise ValueError('Invalid condition format. Use: where <table>.<col> <operator> <value> [and ...]')
+                i += 1
+
+        projection = None
+        if project_clause:
+            projection = [(name.strip(),) + resolve(name.strip()) for name in project_clause.split(',') if name.strip()]
+        return predicates, projection
+
+    # SPLIT A TRAILING "limit <n> [offset <m>]" OFF A QUERY; RETURNS (query, limit, offset), query None IF MALFORMED
+    def parse_limit(self, query):
+        match = re.search(r'\s+limit\s+(\d+)(?:\s+offset\s+(\d+))?\s*;?\s*$', query, re.IGNORECASE)
+        if match is None:
+            return (None, None, 0) if re.search(r'\slimit(\s|$)', query, re.IGNORECASE) else (query, None, 0)
+        return query[:match.start()], int(match.group(1)), int(match.group(2) or 0)
+
+    def parse_order_by(self, query):
+        if 'order by' not in query.lower():
+            return []
+        order_by_index = query.lower().find('order by')
+        order_by_clause = query[order_by_index + 9:].strip()
+
+        order_columns = order_by_clause.split(',')
+        sort_columns = []
+        for col in order_columns:
+            col_parts = col.strip().split()
+            column_name = col_parts[0].strip()
+            ascending = True 
+            if len(col_parts) > 1 and col_parts[1].lower() == 'desc':
+                ascending = False
+            sort_columns.append((column_name, ascending))
+        return sort_columns
+
+    # PARSE "<col> <operator> <value>" OR "<col> between <low> and <high>" INTO (col_name, operator, value)
+    def parse_condition(self, table_name, condition_tokens):
+        def parse_value(col_name, value):
+            value = value.strip('\"')
+            if table_name in self.tables and col_name in self.tables[table_name]['types']:
+                # raises ValueError when the literal does not fit the declared type
+                value = cast_value(self.tables[table_name]['types'][col_name], value)
+            elif table_name in self.tables and col_name in self.tables[table_name]['columns']:
+                value = self.convert_type(self.tables[table_name], col_name, value)
+            return value
+
+        if len(condition_tokens) == 5 and condition_tokens[1].lower() == 'between' and condition_tokens[3].lower() == 'and':
+            col_name = condition_tokens[0]
+            return (col_name, 'between', (parse_value(col_name, condition_tokens[2]), parse_value(col_name, condition_tokens[4])))
+        if len(condition_tokens) >= 3:
+            col_name, operator = condition_tokens[0], self.normalize_operator(condition_tokens[1])
+            if operator is None or operator == 'between':
+                return None
+            return (col_name, operator, parse_value(col_name, " ".join(condition_tokens[2:])))
+        return None
+
         
         
         
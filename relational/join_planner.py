@@ -0,0 +1,80 @@
+from itertools import permutations
+
+# Join orders are searched exhaustively up to this many tables, greedily beyond
+MAX_EXHAUSTIVE_TABLES = 6
+
+
+def estimate_join_rows(left_rows, right_rows, left_distinct, right_distinct):
+    """
+    Estimated size of an equi-join: every key of the side with fewer distinct keys is assumed to
+    find its partners on the other side, |L| * |R| / max(distinct(L.key), distinct(R.key)).
+    """
+    return left_rows * right_rows / max(left_distinct, right_distinct, 1)
+
+
+def _linking_conditions(joined, table, conditions):
+    # The conditions between the tables joined so far and the next one, oriented (joined side, new side)
+    linking = []
+    for t1, c1, t2, c2 in conditions:
+        if t1 in joined and t2 == table:
+            linking.append((t1, c1, t2, c2))
+        elif t2 in joined and t1 == table:
+            linking.append((t2, c2, t1, c1))
+    return linking
+
+
+def _plan_cost(order, conditions, row_counts, distinct_counts):
+    # Left-deep plan: the sum of the estimated sizes of the intermediate results, or None if a table
+    # would have to be joined without any condition (a cross product)
+    rows = row_counts[order[0]]
+    joined = {order[0]}
+    # distinct keys left in the intermediate result, per (table, column)
+    distinct = {}
+    steps = [(order[0], [])]
+    cost = 0
+    for table in order[1:]:
+        linking = _linking_conditions(joined, table, conditions)
+        if not linking:
+            return None, None
+        t1, c1, t2, c2 = linking[0]
+        left_distinct = min(distinct.get((t1, c1), distinct_counts[(t1, c1)]), rows)
+        right_distinct = min(distinct_counts[(t2, c2)], row_counts[t2])
+        rows = estimate_join_rows(rows, row_counts[t2], left_distinct, right_distinct)
+        distinct[(t1, c1)] = distinct[(t2, c2)] = min(left_distinct, right_distinct)
+        cost += rows
+        joined.add(table)
+        steps.append((table, linking))
+    return cost, steps
+
+
+def choose_join_order(tables, conditions, row_counts, distinct_counts):
+    """
+    Pick the cheapest left-deep order to join `tables` on `conditions`, a list of
+    (table1, column1, table2, column2) equalities. row_counts maps each table to its row count and
+    distinct_counts each (table, column) of a condition to its number of distinct values.
+
+    Returns (cost, steps) with steps a list of (table, linking conditions) in join order; the
+    conditions of a step are oriented (joined table, column, new table, column). Orders that would
+    need a cross product are never chosen; (None, None) means the tables are not connected.
+    """
+    if len(tables) <= MAX_EXHAUSTIVE_TABLES:
+        best = (None, None)
+        for order in permutations(tables):
+            cost, steps = _plan_cost(order, conditions, row_counts, distinct_counts)
+            if cost is not None and (best[0] is None or cost < best[0]):
+                best = (cost, steps)
+        return best
+
+    # Greedy: start from the smallest table and keep adding the table that gives the smallest result
+    order = [min(tables, key=lambda table: row_counts[table])]
+    while len(order) < len(tables):
+        candidates = []
+        for table in tables:
+            if table not in order:
+                cost, _ = _plan_cost(order + [table], conditions, row_counts, distinct_counts)
+                if cost is not None:
+                    candidates.append((cost, table))
+        if not candidates:
+            return None, None
+        order.append(min(candidates)[1])
+    return _plan_cost(order, conditions, row_counts, distinct_counts)
@@ -0,0 +1,95 @@
+import json
+import os
+
+from storage_core.external_sort import sort_value
+from storage_core.hash_aggregate import HashAggregate, _to_number
+
+VIEW_STATE_FILE = "view_state.json"
+# Hidden per-group row count, so a group disappears from the view when its last row is deleted
+ROW_COUNT = "__rows"
+
+
+class MaterializedView:
+    """
+    The result of `select <aggregates> from <source> group by <columns>`, kept current by applying the
+    inserted, updated and deleted rows of the source table to the per-group accumulators.
+
+    count, sum and avg accumulators subtract deleted rows exactly. min and max cannot: when a deleted
+    row held a group's minimum or maximum, remove() returns False and the view has to be rebuilt from
+    the source table.
+    """
+
+    def __init__(self, source, group_columns, aggregates, numeric_columns=(), state_path=None):
+        self.source = source
+        self.group_columns = list(group_columns)
+        self.aggregates = [tuple(aggregate) for aggregate in aggregates]
+        self.numeric_columns = set(numeric_columns)
+        self.state_path = state_path
+        # the view's columns are named like Database.group_by names its results
+        self.names = HashAggregate(self.group_columns, self.aggregates).result_names()
+        self.reset()
+
+    def reset(self):
+        self.accumulators = HashAggregate(self.group_columns, self.aggregates + [("count", None)],
+                                          max_groups=float('inf'), numeric_columns=self.numeric_columns,
+                                          names=self.names + [ROW_COUNT])
+
+    @property
+    def columns(self):
+        return self.group_columns + self.names
+
+    def definition(self):
+        return {"source": self.source, "group_columns": self.group_columns,
+                "aggregates": [list(aggregate) for aggregate in self.aggregates]}
+
+    def add(self, rows):
+        self.accumulators.add(rows)
+
+    def remove(self, rows):
+        groups = self.accumulators.groups
+        for row in rows:
+            key = tuple(row.get(col) for col in self.group_columns)
+            states = groups.get(key)
+            if states is None:
+                return False
+            for i, (func, column) in enumerate(self.aggregates):
+                if column is None:
+                    states[i] -= 1
+                    continue
+                value = row.get(column)
+                if value is None or value == '':
+                    continue
+                numeric = column in self.numeric_columns
+                if func in ("sum", "avg") and not numeric:
+                    value = _to_number(value)
+                    if value is None:
+                        continue
+                if func == "count":
+                    states[i] -= 1
+                elif func == "sum":
+                    states[i] -= value
+                elif func == "avg":
+                    states[i] = [states[i][0] - value, states[i][1] - 1] if states[i][1] > 1 else None
+                elif value == states[i] or (not numeric and sort_value(value) == sort_value(states[i])):
+                    # the group's min or max leaves; the next one is only known to the source table
+                    return False
+            states[-1] -= 1
+            if states[-1] == 0:
+                del groups[key]
+        return True
+
+    def rows(self):
+        for row in self.accumulators.results():
+            del row[ROW_COUNT]
+            yield row
+
+    def save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump([[list(key), states] for key, states in self.accumulators.groups.items()], file)
+        os.replace(tmp_path, self.state_path)
+
+    def load_state(self):
+        self.reset()
+        with open(self.state_path, 'r', encoding='utf-8') as file:
+            self.accumulators.groups = {tuple(key): states for key, states in json.load(file)}
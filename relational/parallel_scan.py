@@ -0,0 +1,63 @@
+import json
+
+from columnar import read_columnar_chunk
+from storage_core.hash_aggregate import HashAggregate
+from storage_core.predicates import compile_value_test
+
+# Worker side of the parallel scans of Database. The functions here run in process pool workers, so
+# they are module level and take only plain, picklable arguments:
+#   chunk_files  a list of (file path, row offsets or None) pairs, as planned by Database.plan_chunks
+#   condition    None or (column, column type or None, operator, value)
+# Each worker reads, filters and projects its chunks, or pre-aggregates them, and ships back only
+# the matching records or the per-group accumulators.
+
+
+def batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def read_chunk_file(file_path, columns=None, condition=None):
+    if file_path.endswith(".col"):
+        # columnar chunks test the condition over the whole column and only decode matching rows
+        row_filter = None
+        if condition is not None:
+            col_name, col_type, operator, value = condition
+            row_filter = (col_name, compile_value_test(col_type, operator, value), col_type is None)
+        return read_columnar_chunk(file_path, columns, row_filter)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def filter_chunk_rows(rows, condition=None, projection=None):
+    if condition is not None:
+        col_name, col_type, operator, value = condition
+        test = compile_value_test(col_type, operator, value)
+        rows = [row for row in rows if test(row.get(col_name))]
+    if projection is not None:
+        rows = [{col: row[col] for col in projection} for row in rows]
+    return rows
+
+
+def _read_filtered(chunk_files, columns, condition):
+    for file_path, offsets in chunk_files:
+        rows = read_chunk_file(file_path, columns, condition if offsets is None else None)
+        if offsets is not None:
+            rows = [rows[offset] for offset in offsets if offset < len(rows)]
+        yield filter_chunk_rows(rows, condition)
+
+
+def scan_chunk_files(chunk_files, columns=None, condition=None, projection=None):
+    """Return the records of the chunks that match the condition, projected to `projection`."""
+    result = []
+    for rows in _read_filtered(chunk_files, columns, condition):
+        result.extend(filter_chunk_rows(rows, projection=projection))
+    return result
+
+
+def aggregate_chunk_files(chunk_files, columns=None, condition=None, group_columns=None, aggregates=None,
+                          numeric_columns=()):
+    """Pre-aggregate the matching records of the chunks; returns HashAggregate.partial_states()."""
+    aggregate = HashAggregate(group_columns, aggregates, max_groups=float('inf'), numeric_columns=numeric_columns)
+    for rows in _read_filtered(chunk_files, columns, condition):
+        aggregate.add(rows)
+    return aggregate.partial_states()
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU cache of query results keyed by normalized query text.
+
+    Every entry remembers the versions of the tables its query read. A lookup made with other versions
+    (one of the tables was written since) drops the entry and is a miss, so stale results are never
+    returned and nothing has to be invalidated eagerly. The cache is bounded both by the number of
+    entries and by the total number of result rows it holds; larger results are not cached.
+    """
+
+    def __init__(self, max_entries=128, max_rows=100000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.current_rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize(query):
+        return ' '.join(query.strip().rstrip(';').split())
+
+    def get(self, key, versions):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] != versions:
+            self._remove(key)
+            self.invalidations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, versions, result):
+        self._remove(key)
+        if len(result) > self.max_rows:
+            return
+        self.entries[key] = (versions, result)
+        self.current_rows += len(result)
+        while len(self.entries) > self.max_entries or self.current_rows > self.max_rows:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.current_rows -= len(evicted)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_rows -= len(entry[1])
+
+    def clear(self):
+        self.entries.clear()
+        self.current_rows = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self.entries), "rows": self.current_rows,
+                "max_entries": self.max_entries, "max_rows": self.max_rows}
@@ -0,0 +1,86 @@
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def compute_chunk_stats(chunk_data, columns, types=None):
+    """
+    Build the zone map of one chunk: its row count and, for every column, the null count
+    and the min/max value. Numeric columns keep numeric bounds, text columns keep string bounds
+    (empty strings included, since they take part in string comparisons); a column that mixes
+    both gets no bounds, so it never causes a chunk to be skipped. Columns typed as string in
+    `types` compare as text, so numeric-looking values get string bounds there.
+    """
+    types = types or {}
+    column_stats = {}
+    for col in columns:
+        as_text = types.get(col) == "string"
+        null_count = 0
+        numbers = []
+        strings = []
+        for record in chunk_data:
+            value = record.get(col)
+            if value is None or value == '':
+                null_count += 1
+                if value is None:
+                    continue
+            converted = value if as_text else _to_number(value)
+            if isinstance(converted, float):
+                numbers.append(converted)
+            else:
+                strings.append(str(value))
+
+        non_empty_strings = [s for s in strings if s != '']
+        if numbers and not non_empty_strings:
+            stats = {"min": min(numbers), "max": max(numbers), "numeric": True}
+        elif strings and not numbers:
+            stats = {"min": min(strings), "max": max(strings), "numeric": False}
+        else:
+            stats = {"min": None, "max": None, "numeric": False}
+        stats["null_count"] = null_count
+        column_stats[col] = stats
+
+    return {"count": len(chunk_data), "columns": column_stats}
+
+
+def chunk_may_match(chunk_stats, col_name, operator, value, col_type=None):
+    """
+    Return False only when the chunk's zone map proves that no record can satisfy
+    `col_name <operator> value` under the typed comparison used by Database.apply_condition.
+    A string column (col_type "string") compares the literal as text.
+    """
+    if chunk_stats is None:
+        return True
+    if chunk_stats["count"] == 0:
+        return False
+
+    if operator == "between":
+        return (chunk_may_match(chunk_stats, col_name, ">=", value[0], col_type)
+                and chunk_may_match(chunk_stats, col_name, "<=", value[1], col_type))
+
+    stats = chunk_stats["columns"].get(col_name)
+    if stats is None or stats["min"] is None:
+        return True
+
+    value = str(value) if col_type == "string" else _to_number(value)
+    if isinstance(value, float) != stats["numeric"]:
+        return True
+    if not stats["numeric"]:
+        value = str(value)
+
+    low, high = stats["min"], stats["max"]
+    if operator == "==":
+        return low <= value <= high
+    elif operator == "<":
+        return low < value
+    elif operator == "<=":
+        return low <= value
+    elif operator == ">":
+        return high > value
+    elif operator == ">=":
+        return high >= value
+    elif operator == "!=":
+        return not (low == high == value and stats["null_count"] == 0)
+    return True
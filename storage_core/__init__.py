@@ -0,0 +1,7 @@
+"""
+Storage and query building blocks shared by the relational engine (relational/database_v2.py) and the
+NoSQL engine (project_nosql/nosql_v4.py): the catalog, the chunk cache, indexes, external sort, hash
+aggregation, the row operators, predicates and column types.
+
+Install it once from the repository root (pip install -e .) so both engines can import it.
+"""
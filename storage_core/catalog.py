@@ -0,0 +1,93 @@
+import json
+import os
+
+CATALOG_FILE = "catalog.json"
+CATALOG_LOG_FILE = "catalog_log.jsonl"
+
+
+class Catalog:
+    """
+    One file per data directory describing every table (or collection) in it, so opening a database
+    reads a single file instead of scanning every table directory. Entries are plain dicts owned by the
+    engine.
+
+    save(name) appends only that table's entry to a log next to the catalog, so a write to one table
+    does not rewrite the others. Once the log holds more lines than the catalog has tables it is folded
+    in: the whole catalog is written to a temporary file and renamed over the old one, so a reader sees
+    either the previous or the new catalog, never a mix. Log lines carry the generation of the catalog
+    file they extend, and lines left from an older generation are ignored.
+    """
+
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, CATALOG_FILE)
+        self.log_path = os.path.join(data_dir, CATALOG_LOG_FILE)
+        self.entries = {}
+        self.generation = 0
+        self.log_lines = 0
+        # False until the file exists, so the engine knows to build the catalog from its directories
+        self.exists = False
+
+    @classmethod
+    def load(cls, data_dir):
+        catalog = cls(data_dir)
+        if os.path.exists(catalog.path):
+            try:
+                with open(catalog.path, 'r', encoding='utf-8') as file:
+                    content = json.load(file)
+                catalog.entries = content["tables"]
+                catalog.generation = content.get("generation", 0)
+                catalog.exists = True
+            except (ValueError, KeyError):
+                # a damaged catalog is rebuilt by the engine like a missing one
+                catalog.entries = {}
+                return catalog
+            catalog.replay_log()
+        return catalog
+
+    def replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'r', encoding='utf-8') as log_file:
+            for line in log_file:
+                # a torn last line from an interrupted write is ignored
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("generation") != self.generation:
+                    continue
+                if record["entry"] is None:
+                    self.entries.pop(record["table"], None)
+                else:
+                    self.entries[record["table"]] = record["entry"]
+                self.log_lines += 1
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def set(self, name, entry):
+        self.entries[name] = entry
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+
+    def save(self, name=None):
+        """Persist the entry of one table (or its removal), or with no name the whole catalog."""
+        if name is None or not self.exists or self.log_lines >= max(len(self.entries), 16):
+            self.rewrite()
+            return
+        with open(self.log_path, 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps({"generation": self.generation, "table": name,
+                                       "entry": self.entries.get(name)}) + '\n')
+        self.log_lines += 1
+
+    def rewrite(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"version": 1, "generation": self.generation + 1, "tables": self.entries}, file)
+        os.replace(tmp_path, self.path)
+        self.generation += 1
+        self.exists = True
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.log_lines = 0
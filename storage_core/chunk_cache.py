@@ -0,0 +1,83 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class ChunkCache:
+    """
+    LRU cache of decoded chunk files, bounded in bytes and shared by the engines of a process.
+
+    An entry is keyed by file path (plus a variant, such as the column subset of a columnar read) and
+    remembers the file's mtime and size: a lookup whose file changed on disk is a miss. The engines
+    also invalidate a path whenever they rewrite or remove it. Entries are charged with the size of
+    the file on disk. Cached chunks are shared between callers and must be treated as read-only; the
+    engines copy records before handing them out of a query.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, loader, variant=None):
+        """Return the decoded chunk at `path`, calling loader(path) on a miss."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            raise
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = (path, variant)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        data = loader(path)
+
+        with self.lock:
+            self._remove(key)
+            if stat.st_size <= self.max_bytes:
+                self.entries[key] = (stamp, data, stat.st_size)
+                self.current_bytes += stat.st_size
+                while self.current_bytes > self.max_bytes:
+                    _, (_, _, size) = self.entries.popitem(last=False)
+                    self.current_bytes -= size
+                    self.evictions += 1
+        return data
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+        return entry is not None
+
+    def invalidate(self, path):
+        # Drop every variant of a file the engine rewrote or removed
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == path]:
+                if self._remove(key):
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self.entries),
+                "bytes": self.current_bytes, "max_bytes": self.max_bytes}
+
+
+# The cache both engines use unless they are given their own (or None to disable caching)
+SHARED_CHUNK_CACHE = ChunkCache()
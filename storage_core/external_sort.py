@@ -0,0 +1,102 @@
+import heapq
+import json
+import os
+import tempfile
+
+
+class _Descending:
+    """Wraps a sort key so that it orders in reverse."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def sort_value(value):
+    # Numbers and numeric strings ("116.0") sort numerically, before text; nulls sort last
+    if value is None or value == '':
+        return (2, 0, '')
+    if isinstance(value, bool):
+        return (0, float(value), '')
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    try:
+        return (0, float(value), '')
+    except (TypeError, ValueError):
+        return (1, 0, str(value))
+
+
+def descending(key):
+    # Reverse the order of a sort_value key; nulls still sort last
+    return (key[0] == 2, _Descending(key))
+
+
+def make_sort_key(sort_columns):
+    # sort_columns is a list of (column, ascending) pairs
+    def key(row):
+        parts = []
+        for col, ascending in sort_columns:
+            value = sort_value(row.get(col))
+            parts.append(value if ascending else descending(value))
+        return tuple(parts)
+    return key
+
+
+def sort_rows(rows, sort_columns, limit=None, max_rows_in_memory=100000, tmp_dir=None):
+    """
+    Sort an iterable of row dicts on several (column, ascending) keys and return an iterator.
+
+    With a limit only the best `limit` rows are kept in a bounded heap. Otherwise rows are
+    sorted in memory while they fit in `max_rows_in_memory`; beyond that, sorted runs are
+    spilled to temporary files and k-way merged.
+    """
+    key = make_sort_key(sort_columns)
+
+    if limit is not None:
+        return iter(heapq.nsmallest(limit, rows, key=key))
+
+    buffer = []
+    run_paths = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= max_rows_in_memory:
+            buffer.sort(key=key)
+            run_paths.append(_write_run(buffer, tmp_dir))
+            buffer = []
+
+    buffer.sort(key=key)
+    if not run_paths:
+        return iter(buffer)
+    return _merge_runs(run_paths, buffer, key)
+
+
+def _write_run(rows, tmp_dir):
+    fd, path = tempfile.mkstemp(prefix='sort_run_', suffix='.jsonl', dir=tmp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        for row in rows:
+            file.write(json.dumps(row))
+            file.write('\n')
+    return path
+
+
+def _read_run(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def _merge_runs(run_paths, buffer, key):
+    try:
+        runs = [_read_run(path) for path in run_paths]
+        runs.append(iter(buffer))
+        yield from heapq.merge(*runs, key=key)
+    finally:
+        for path in run_paths:
+            if os.path.exists(path):
+                os.remove(path)
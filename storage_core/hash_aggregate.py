@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import tempfile
+
+from .external_sort import sort_value
+
+AGGREGATE_FUNCTIONS = ("count", "sum", "avg", "min", "max")
+_AGGREGATE_PATTERN = re.compile(r'^\s*(\w+)\s*\(\s*([\w*.]*)\s*\)\s*$')
+
+
+def parse_aggregates(select_list):
+    """
+    Parse "count(*), avg(vote_average), max(runtime)" into [(func, column), ...].
+    count(*) has the column None. Raises ValueError on anything else.
+    """
+    aggregates = []
+    for part in select_list.split(','):
+        match = _AGGREGATE_PATTERN.match(part)
+        if not match or match.group(1).lower() not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Invalid aggregate {part.strip()!r}.")
+        func, column = match.group(1).lower(), match.group(2)
+        if column in ('', '*'):
+            if func != "count":
+                raise ValueError(f"{func} needs a column.")
+            column = None
+        aggregates.append((func, column))
+    return aggregates
+
+
+def _to_number(value):
+    # Text columns hold numbers as strings; values that are not numbers are left out of sums
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _group_part(value):
+    # Arrays and nested documents are not hashable; they group by their JSON text, wrapped in a tuple
+    # so that they never collide with a string value and can be turned back into the value
+    if isinstance(value, (list, dict)):
+        return ("json", json.dumps(value, sort_keys=True))
+    return value
+
+
+def _group_value(part):
+    if isinstance(part, (list, tuple)):
+        return json.loads(part[1])
+    return part
+
+
+class HashAggregate:
+    """
+    Streaming GROUP BY. Only one accumulator per group and aggregate is kept in memory, never the rows:
+    count and sum are running totals, avg is a running sum and count, min and max the best value so far.
+
+    When more than `max_groups` groups are held, the partial accumulators are spilled to `partitions`
+    temporary files by hash of the group key and memory starts over. At the end every partition is
+    read back on its own and its partial accumulators are combined, so at most about
+    1/partitions of the groups are in memory at once.
+
+    `numeric_columns` lists columns that already hold numbers (typed columns); the values of the
+    others are converted on the way in. `names` overrides the result names of the aggregates.
+    """
+
+    def __init__(self, group_columns, aggregates, max_groups=100000, partitions=16, numeric_columns=(), tmp_dir=None,
+                 names=None):
+        self.group_columns = list(group_columns or [])
+        self.aggregates = list(aggregates)
+        self.max_groups = max_groups
+        self.partitions = partitions
+        self.numeric_columns = set(numeric_columns)
+        self.tmp_dir = tmp_dir
+        self.groups = {}
+        self.partition_paths = []
+        self.spilled_groups = 0
+        self.names = names
+
+    def result_names(self):
+        if self.names is not None:
+            return list(self.names)
+        # A single aggregate keeps the plain name ("count", "sum", ...) the engines always returned
+        if len(self.aggregates) == 1:
+            return [self.aggregates[0][0]]
+        return [f"{func}({column or '*'})" for func, column in self.aggregates]
+
+    def add(self, rows):
+        group_columns = self.group_columns
+        aggregates = self.aggregates
+        groups = self.groups
+        for row in rows:
+            key = tuple(_group_part(row.get(col)) for col in group_columns)
+            states = groups.get(key)
+            if states is None:
+                if len(groups) >= self.max_groups:
+                    self._spill()
+                    groups = self.groups
+                states = groups[key] = [None] * len(aggregates)
+            for i, (func, column) in enumerate(aggregates):
+                if column is None:
+                    states[i] = (states[i] or 0) + 1
+                    continue
+                value = row.get(column)
+                if value is None or value == '':
+                    continue
+                if func in ("sum", "avg") and column not in self.numeric_columns:
+                    value = _to_number(value)
+                    if value is None:
+                        continue
+                states[i] = self._accumulate(func, states[i], value, column in self.numeric_columns)
+
+    @staticmethod
+    def _accumulate(func, state, value, numeric):
+        if func == "count":
+            return (state or 0) + 1
+        if func == "sum":
+            return value if state is None else state + value
+        if func == "avg":
+            return [value, 1] if state is None else [state[0] + value, state[1] + 1]
+        if state is None:
+            return value
+        # untyped columns compare like ORDER BY does: numeric text as numbers, before other text
+        if numeric:
+            better = value < state if func == "min" else value > state
+        else:
+            better = sort_value(value) < sort_value(state) if func == "min" else sort_value(value) > sort_value(state)
+        return value if better else state
+
+    def partial_states(self):
+        """The accumulators held in memory as (key, states) pairs, for merging with add_partial."""
+        return list(self.groups.items())
+
+    def add_partial(self, partial_states):
+        # Merge accumulators built by another HashAggregate over the same groups and aggregates
+        for key, states in partial_states:
+            if key in self.groups:
+                self._combine(self.groups[key], states)
+                continue
+            if len(self.groups) >= self.max_groups:
+                self._spill()
+            self.groups[key] = states
+
+    def _combine(self, states, other):
+        for i, (func, column) in enumerate(self.aggregates):
+            if other[i] is None:
+                continue
+            if states[i] is None:
+                states[i] = other[i]
+            elif func == "count" or func == "sum":
+                states[i] += other[i]
+            elif func == "avg":
+                states[i] = [states[i][0] + other[i][0], states[i][1] + other[i][1]]
+            else:
+                states[i] = self._accumulate(func, states[i], other[i], column in self.numeric_columns)
+
+    def _spill(self):
+        if not self.partition_paths:
+            for _ in range(self.partitions):
+                fd, path = tempfile.mkstemp(prefix='aggregate_', suffix='.jsonl', dir=self.tmp_dir)
+                os.close(fd)
+                self.partition_paths.append(path)
+        files = [open(path, 'a', encoding='utf-8') for path in self.partition_paths]
+        try:
+            for key, states in self.groups.items():
+                files[hash(key) % self.partitions].write(json.dumps([list(key), states]) + '\n')
+        finally:
+            for file in files:
+                file.close()
+        self.spilled_groups += len(self.groups)
+        self.groups = {}
+
+    def _finish(self, key, states):
+        result = {col: _group_value(part) for col, part in zip(self.group_columns, key)}
+        for name, (func, _), state in zip(self.result_names(), self.aggregates, states):
+            if func == "count":
+                result[name] = state or 0
+            elif func == "avg":
+                result[name] = state[0] / state[1] if state else None
+            else:
+                result[name] = state
+        return result
+
+    def results(self):
+        """Yield one result dict per group; removes the spill files once read."""
+        if not self.partition_paths:
+            for key, states in self.groups.items():
+                yield self._finish(key, states)
+            return
+
+        self._spill()
+        try:
+            for path in self.partition_paths:
+                groups = {}
+                with open(path, 'r', encoding='utf-8') as file:
+                    for line in file:
+                        key, states = json.loads(line)
+                        key = tuple(tuple(part) if isinstance(part, list) else part for part in key)
+                        if key in groups:
+                            self._combine(groups[key], states)
+                        else:
+                            groups[key] = states
+                os.remove(path)
+                for key, states in groups.items():
+                    yield self._finish(key, states)
+        finally:
+            for path in self.partition_paths:
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,185 @@
+import bisect
+import heapq
+import json
+import os
+
+from .external_sort import descending, sort_value
+
+
+def index_key(value):
+    # Normalize the way apply_condition compares: "19995", "19995.0" and 19995 are the same key
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if number.is_integer():
+        return str(int(number))
+    return repr(number)
+
+
+class HashIndex:
+    """
+    Persistent equality index of one column. Entries are grouped per chunk file
+    ({chunk_file: {key: [row offsets]}}) so that rewriting a chunk only replaces that chunk's entries.
+    In memory the same entries are also kept by key ({key: {chunk_file: [row offsets]}}), built on load,
+    so a lookup does not visit every chunk. col_type is the declared type of the column, if it has one.
+    """
+    kind = "hash"
+
+    def __init__(self, name, column, path, entries=None, col_type=None):
+        self.name = name
+        self.column = column
+        self.path = path
+        self.entries = entries if entries is not None else {}
+        self.col_type = col_type
+        self.dirty = False
+        self.key_map = {}
+        for file_name, chunk_entries in self.entries.items():
+            self._map_chunk(file_name, chunk_entries)
+
+    @classmethod
+    def load(cls, name, column, path, col_type=None):
+        entries = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                entries = json.load(file)["entries"]
+        return cls(name, column, path, entries, col_type)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"column": self.column, "type": self.kind, "entries": self.entries}, file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def record_values(self, record):
+        # The values a record is indexed under; multikey indexes return several
+        return [record[self.column]] if self.column in record else []
+
+    def _map_chunk(self, file_name, chunk_entries):
+        for key, offsets in chunk_entries.items():
+            self.key_map.setdefault(key, {})[file_name] = offsets
+
+    def _unmap_chunk(self, file_name):
+        for key in self.entries.get(file_name, ()):
+            chunks = self.key_map[key]
+            del chunks[file_name]
+            if not chunks:
+                del self.key_map[key]
+
+    def index_chunk(self, file_name, chunk_data):
+        chunk_entries = {}
+        for offset, record in enumerate(chunk_data):
+            for value in self.record_values(record):
+                offsets = chunk_entries.setdefault(index_key(value), [])
+                if not offsets or offsets[-1] != offset:
+                    offsets.append(offset)
+        self._unmap_chunk(file_name)
+        self.entries[file_name] = chunk_entries
+        self._map_chunk(file_name, chunk_entries)
+        self.dirty = True
+
+    def drop_chunk(self, file_name):
+        # Forget the entries of a chunk file that no longer exists
+        self._unmap_chunk(file_name)
+        self.entries.pop(file_name, None)
+        self.dirty = True
+
+    def clear(self):
+        for file_name in list(self.entries):
+            self.drop_chunk(file_name)
+        self.dirty = True
+
+    def distinct_count(self):
+        return len(self.key_map)
+
+    def lookup(self, value):
+        # Returns {chunk_file: [row offsets]} for the chunks holding the value
+        return dict(self.key_map.get(index_key(value), {}))
+
+
+class SortedIndex(HashIndex):
+    """
+    Persistent ordered index of one column, kept as one sorted run of typed keys per chunk file
+    ({chunk_file: {"keys": [...], "offsets": [...]}}). Range lookups bisect every run; ordered
+    iteration merges the runs. A string column compares as text, so its keys keep plain text order
+    instead of putting numeric-looking text first.
+    """
+    kind = "sorted"
+
+    def __init__(self, name, column, path, entries=None, col_type=None):
+        # JSON stores the typed keys as lists; bisect and merge need tuples
+        for run in (entries or {}).values():
+            run["keys"] = [tuple(key) for key in run["keys"]]
+        super().__init__(name, column, path, entries, col_type)
+
+    # key_map holds {key: number of runs holding it}; lookups bisect the runs instead
+    def _map_chunk(self, file_name, run):
+        for key in set(run["keys"]):
+            self.key_map[key] = self.key_map.get(key, 0) + 1
+
+    def _unmap_chunk(self, file_name):
+        run = self.entries.get(file_name)
+        for key in set(run["keys"]) if run is not None else ():
+            self.key_map[key] -= 1
+            if not self.key_map[key]:
+                del self.key_map[key]
+
+    def sort_key(self, value):
+        if self.col_type == "string":
+            # the empty string is text like any other; only missing values sort last
+            return (2, 0, '') if value is None else (1, 0, str(value))
+        return sort_value(value)
+
+    def index_chunk(self, file_name, chunk_data):
+        run = sorted(set((self.sort_key(value), offset)
+                         for offset, record in enumerate(chunk_data) for value in self.record_values(record)))
+        self._unmap_chunk(file_name)
+        self.entries[file_name] = {"keys": [key for key, _ in run], "offsets": [offset for _, offset in run]}
+        self._map_chunk(file_name, self.entries[file_name])
+        self.dirty = True
+
+    def lookup(self, value):
+        return self.range_lookup(value, value)
+
+    def range_lookup(self, low=None, high=None, include_low=True, include_high=True):
+        """
+        Return {chunk_file: [row offsets]} for keys between low and high (None means unbounded).
+        Keys are compared like apply_condition does, so a numeric bound only matches numeric
+        values; a text bound also returns the empty values, which compare as empty strings.
+        """
+        bound = low if low is not None else high
+        rank = self.sort_key(bound)[0]
+        low_key = self.sort_key(low) if low is not None else (rank, float('-inf'), '')
+        high_key = self.sort_key(high) if high is not None else (rank, float('inf'), '\U0010ffff')
+
+        locations = {}
+        for file_name, run in self.entries.items():
+            keys = run["keys"]
+            start = bisect.bisect_left(keys, low_key) if include_low else bisect.bisect_right(keys, low_key)
+            end = bisect.bisect_right(keys, high_key) if include_high else bisect.bisect_left(keys, high_key)
+            offsets = run["offsets"][start:end]
+            if rank == 1:
+                # empty values sort last but take part in string comparisons
+                offsets = offsets + run["offsets"][bisect.bisect_left(keys, (2,)):]
+            if offsets:
+                locations[file_name] = offsets
+        return locations
+
+    def iter_ordered(self, ascending=True):
+        # Yield (chunk_file, row offset) pairs in key order across all runs; nulls come last either way
+        def run_entries(file_name, run):
+            pairs = list(zip(run["keys"], run["offsets"]))
+            if not ascending:
+                nulls = bisect.bisect_left(run["keys"], (2,))
+                pairs = pairs[nulls - 1::-1] + pairs[nulls:] if nulls else pairs
+            for key, offset in pairs:
+                yield key, file_name, offset
+
+        runs = [run_entries(file_name, run) for file_name, run in self.entries.items()]
+        order = (lambda entry: entry[0]) if ascending else (lambda entry: descending(entry[0]))
+        for _, file_name, offset in heapq.merge(*runs, key=order):
+            yield file_name, offset
+
+
+INDEX_TYPES = {"hash": HashIndex, "sorted": SortedIndex}
@@ -0,0 +1,229 @@
+import json
+import os
+import tempfile
+from itertools import chain, groupby, islice
+
+from .external_sort import sort_rows, sort_value
+from .hash_aggregate import HashAggregate
+from .indexes import index_key
+
+# Generator operators for query pipelines, shared by the relational and the NoSQL engine:
+#   scan -> filter -> project -> join -> aggregate -> sort -> limit
+# Each operator takes an iterable of row dicts and yields row dicts, so rows flow through a pipeline
+# one at a time. Only the hash table of a join, the groups of an aggregate and the runs of a sort are
+# buffered; grace_hash_join, the aggregate and the sort spill to disk beyond their memory budgets.
+
+# Partitions of a grace hash join that are still too big are partitioned again, at most this many times
+MAX_PARTITION_LEVELS = 3
+
+
+def scan_rows(chunks):
+    """Flatten an iterable of chunks (lists of rows) into a stream of rows."""
+    for chunk_data in chunks:
+        yield from chunk_data
+
+
+def filter_rows(rows, predicate):
+    for row in rows:
+        if predicate(row):
+            yield row
+
+
+def project_rows(rows, columns):
+    for row in rows:
+        yield {col: row.get(col) for col in columns}
+
+
+def _join_key(value):
+    # Keys match the way WHERE compares them: "28", "28.0" and 28 are the same key. Null and empty
+    # keys never match
+    if value is None or value == '':
+        return None
+    return index_key(value)
+
+
+def hash_join(build_rows, probe_rows, build_column, probe_column, build_is_left=True,
+              pad_unmatched_probe=None, pad_unmatched_build=None):
+    """
+    Equi-join two row streams. The build rows are held in a hash table and the probe rows stream
+    through it; joined rows merge the left row first, then the right one.
+
+    pad_unmatched_probe / pad_unmatched_build make the join outer on that side: rows without a
+    partner are emitted merged into the given dict (usually the other side's columns set to null),
+    the probe rows as they stream, the build rows at the end. Keys compare like WHERE compares
+    values, numeric text as numbers; null and empty keys never match.
+    """
+    hash_table = {}
+    unmatched_build = []
+    for row in build_rows:
+        key = _join_key(row.get(build_column))
+        if key is not None:
+            hash_table.setdefault(key, []).append(row)
+        elif pad_unmatched_build is not None:
+            unmatched_build.append(row)
+
+    matched_keys = set()
+    for probe_row in probe_rows:
+        key = _join_key(probe_row.get(probe_column))
+        build_matches = hash_table.get(key) if key is not None else None
+        if build_matches:
+            if pad_unmatched_build is not None:
+                matched_keys.add(key)
+            for build_row in build_matches:
+                yield {**build_row, **probe_row} if build_is_left else {**probe_row, **build_row}
+        elif pad_unmatched_probe is not None:
+            yield {**pad_unmatched_probe, **probe_row}
+
+    # Emit the build rows that never found a partner
+    if pad_unmatched_build is not None:
+        for key, build_matches in hash_table.items():
+            if key not in matched_keys:
+                unmatched_build.extend(build_matches)
+        for build_row in unmatched_build:
+            yield {**pad_unmatched_build, **build_row}
+
+
+def _write_partitions(rows, column, partitions, level, tmp_dir):
+    # Hash rows into partition files on their join key; the level salts the hash for re-partitioning
+    paths = []
+    files = []
+    try:
+        for _ in range(partitions):
+            fd, path = tempfile.mkstemp(prefix='join_', suffix='.jsonl', dir=tmp_dir)
+            paths.append(path)
+            files.append(os.fdopen(fd, 'w', encoding='utf-8'))
+        for row in rows:
+            files[hash((level, _join_key(row.get(column)))) % partitions].write(json.dumps(row) + '\n')
+    except BaseException:
+        for file in files:
+            file.close()
+        _remove_files(paths)
+        raise
+    for file in files:
+        file.close()
+    return paths
+
+
+def _read_partition(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def grace_hash_join(build_rows, probe_rows, build_column, probe_column, build_is_left=True,
+                    pad_unmatched_probe=None, pad_unmatched_build=None, max_build_rows=100000, partitions=16,
+                    tmp_dir=None, _level=0):
+    """
+    hash_join for build sides that may not fit in memory. While the build side has at most
+    `max_build_rows` rows it is an in-memory hash_join. Beyond that, both inputs are hashed on their
+    join keys into `partitions` temporary files, and the matching pairs of partitions are joined one
+    at a time (partitioned again if still too big), so about 1/partitions of the build side is held
+    at once. Rows are streamed out either way, and the partition files are removed as they are used.
+    """
+    build_rows = iter(build_rows)
+    buffered = list(islice(build_rows, max_build_rows + 1))
+    if len(buffered) <= max_build_rows or _level >= MAX_PARTITION_LEVELS:
+        # fits in memory, or a partition that re-partitioning cannot split (one huge key)
+        yield from hash_join(chain(buffered, build_rows), probe_rows, build_column, probe_column, build_is_left,
+                             pad_unmatched_probe, pad_unmatched_build)
+        return
+
+    build_paths = _write_partitions(chain(buffered, build_rows), build_column, partitions, _level, tmp_dir)
+    buffered = None
+    probe_paths = []
+    try:
+        probe_paths = _write_partitions(probe_rows, probe_column, partitions, _level, tmp_dir)
+        for build_path, probe_path in zip(build_paths, probe_paths):
+            yield from grace_hash_join(_read_partition(build_path), _read_partition(probe_path), build_column,
+                                       probe_column, build_is_left, pad_unmatched_probe, pad_unmatched_build,
+                                       max_build_rows, partitions, tmp_dir, _level + 1)
+            os.remove(build_path)
+            os.remove(probe_path)
+    finally:
+        _remove_files(build_paths + probe_paths)
+
+
+class UnsortedInput(ValueError):
+    """Raised by merge_join when an input turns out not to be sorted on its join column."""
+
+
+def _key_groups(rows, column):
+    # Runs of rows with the same join key, checking that the keys ascend
+    previous = None
+    for sort_key, group in groupby(rows, key=lambda row: sort_value(row.get(column))):
+        if previous is not None and sort_key < previous:
+            raise UnsortedInput(f"Rows are not sorted on {column}.")
+        previous = sort_key
+        yield sort_key, list(group)
+
+
+def merge_join(left_rows, right_rows, left_column, right_column, pad_unmatched_left=None, pad_unmatched_right=None):
+    """
+    Equi-join two row streams that are both sorted on their join column, in ORDER BY order (see
+    sort_value), in a single pass. Only the rows of the current key of each side are held, so memory
+    does not grow with the inputs; the output comes out in key order. Joined rows and the padding of
+    unmatched rows (pad_unmatched_left / pad_unmatched_right, for outer joins) are built like in
+    hash_join, and null and empty keys never match. Raises UnsortedInput on a key out of order.
+    """
+    left_groups = _key_groups(left_rows, left_column)
+    right_groups = _key_groups(right_rows, right_column)
+    left = next(left_groups, None)
+    right = next(right_groups, None)
+
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[0] < right[0]):
+            if pad_unmatched_left is not None:
+                for left_row in left[1]:
+                    yield {**pad_unmatched_left, **left_row}
+            left = next(left_groups, None)
+            continue
+        if left is None or right[0] < left[0]:
+            if pad_unmatched_right is not None:
+                for right_row in right[1]:
+                    yield {**pad_unmatched_right, **right_row}
+            right = next(right_groups, None)
+            continue
+
+        # Same sort key on both sides; rows still pair up only on equal keys, like in hash_join
+        partners = {}
+        if left[0][0] != 2:
+            for right_row in right[1]:
+                partners.setdefault(_join_key(right_row.get(right_column)), []).append(right_row)
+        matched_keys = set()
+        for left_row in left[1]:
+            key = _join_key(left_row.get(left_column))
+            right_matches = partners.get(key)
+            if right_matches:
+                matched_keys.add(key)
+                for right_row in right_matches:
+                    yield {**left_row, **right_row}
+            elif pad_unmatched_left is not None:
+                yield {**pad_unmatched_left, **left_row}
+        if pad_unmatched_right is not None:
+            for right_row in right[1]:
+                if _join_key(right_row.get(right_column)) not in matched_keys:
+                    yield {**pad_unmatched_right, **right_row}
+        left = next(left_groups, None)
+        right = next(right_groups, None)
+
+
+def aggregate_rows(rows, group_columns, aggregates, **options):
+    """GROUP BY: yields one row per group; options go to HashAggregate (max_groups, numeric_columns, ...)."""
+    aggregate = HashAggregate(group_columns, aggregates, **options)
+    aggregate.add(rows)
+    yield from aggregate.results()
+
+
+def order_rows(rows, sort_columns, limit=None, max_rows_in_memory=100000):
+    """ORDER BY on (column, ascending) pairs; sorts in memory or spills sorted runs (see sort_rows)."""
+    yield from sort_rows(rows, sort_columns, limit=limit, max_rows_in_memory=max_rows_in_memory)
+
+
+def limit_rows(rows, count, offset=0):
+    return islice(rows, offset, offset + count if count is not None else None)
@@ -0,0 +1,55 @@
+from functools import partial
+from operator import eq, ne, lt, le, gt, ge
+
+from .schema import cast_value
+
+# comparisons with the literal as the left operand: "x < 5" is checked as gt(5, x)
+REVERSED_COMPARISONS = {"==": eq, "!=": ne, "<": gt, "<=": ge, ">": lt, ">=": le}
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def compile_value_test(col_type, operator, value):
+    """
+    Compile `<column> <operator> <value>` once into a test of a single stored value. The operator is
+    resolved and the literal converted here, not per row. Typed columns (col_type set) compare stored
+    values as they are; untyped columns compare like Database.apply_condition, numeric text as numbers.
+    Missing values never match. The test only depends on its arguments, so process pool workers can
+    compile the same condition on their side.
+    """
+    convert = (lambda literal: cast_value(col_type, literal)) if col_type is not None else _to_number
+
+    if operator == "between":
+        low, high = (convert(bound) for bound in value)
+        compare = lambda record_value: low <= record_value <= high
+    else:
+        literal = convert(value)
+        compare = partial(REVERSED_COMPARISONS[operator], literal)
+
+    if col_type is not None:
+        def test(record_value):
+            return record_value is not None and compare(record_value)
+        return test
+
+    mismatch = operator == "!="
+    def test(record_value):
+        if record_value is None:
+            return False
+        try:
+            return compare(float(record_value))
+        except ValueError:
+            # non-numeric text
+            pass
+        except TypeError:
+            # a number compared with a text literal: only != can hold
+            return mismatch
+        try:
+            return compare(record_value)
+        except TypeError:
+            return mismatch
+    return test
@@ -0,0 +1,78 @@
+import ast
+import datetime
+import json
+
+COLUMN_TYPES = ("int", "float", "date", "string", "list")
+NUMERIC_TYPES = ("int", "float")
+# tried in this order when inferring, narrowest first
+INFERRED_TYPES = ("int", "float", "date", "list")
+
+
+def cast_value(col_type, value):
+    """
+    Convert a value (usually the text typed in a query or read from a CSV) to a column type.
+    Empty values become None, except for string columns. Raises ValueError if the value does not fit.
+    """
+    if col_type is None or col_type == "string":
+        return value if value is None or isinstance(value, str) else str(value)
+    if value is None or value == '':
+        return None
+
+    if col_type == "int":
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            number = float(value)
+            if not number.is_integer():
+                raise
+            return int(number)
+    elif col_type == "float":
+        return float(value)
+    elif col_type == "date":
+        # dates are kept as ISO strings, which sort and compare in date order
+        return datetime.date.fromisoformat(str(value)).isoformat()
+    elif col_type == "list":
+        if isinstance(value, list):
+            return value
+        text = str(value).strip()
+        if not text.startswith('['):
+            raise ValueError(f"Not a list: {value!r}")
+        try:
+            return json.loads(text)
+        except ValueError:
+            parsed = ast.literal_eval(text)
+            if not isinstance(parsed, list):
+                raise ValueError(f"Not a list: {value!r}")
+            return parsed
+    raise ValueError(f"Unknown column type {col_type}.")
+
+
+def _fits(col_type, value):
+    try:
+        cast_value(col_type, value)
+    except (ValueError, SyntaxError, TypeError):
+        return False
+    return True
+
+
+def infer_column_types(records, columns):
+    """
+    Pick, for every column, the narrowest type that all its non-empty values fit.
+    Records are read once, so they can come from a stream; columns with no values are strings.
+    """
+    candidates = {col: list(INFERRED_TYPES) for col in columns}
+    seen = set()
+    for record in records:
+        for col in columns:
+            value = record.get(col)
+            if value is None or value == '' or not candidates[col]:
+                continue
+            seen.add(col)
+            candidates[col] = [col_type for col_type in candidates[col] if _fits(col_type, value)]
+    return {col: candidates[col][0] if col in seen and candidates[col] else "string" for col in columns}
+
+
+def cast_record(record, types):
+    return {col: cast_value(types.get(col), value) for col, value in record.items()}